@@ -0,0 +1,140 @@
+"""Планировщик авто-ответов: окно «не чаще раза в N» в памяти, ожидающие — в SQLite."""
+import asyncio
+import heapq
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+
+from database import (
+    load_recent_auto_replies,
+    load_pending_auto_replies,
+    save_pending_auto_reply,
+    delete_pending_auto_reply,
+    update_auto_reply_time,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AutoReplyScheduler:
+    """
+    Авто-ответ через delay секунд после сообщения клиента, не чаще раза в window секунд.
+
+    Время последних авто-ответов хранится в памяти (user_id → epoch) и
+    загружается при старте только за последнее окно — проверка на каждое
+    сообщение не ходит в БД. Ожидающие авто-ответы пишутся в таблицу
+    pending_auto_replies и после рестарта планируются заново. Таймер один на
+    всех: min-heap по времени срабатывания и одна задача, спящая до ближайшего.
+    """
+
+    def __init__(self, delay: float, window: float):
+        self._delay = delay
+        self._window = window
+        self._last_sent: dict[int, float] = {}
+        self._pending: dict[int, float] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._send: Callable[[int], Awaitable[bool]] | None = None
+        self._timer: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        self._last_cleanup = time.time()
+        self.sent = 0
+        self.failed = 0
+
+    async def start(self, send: Callable[[int], Awaitable[bool]]):
+        """Загрузить состояние из БД и запустить таймер. send(user_id) → отправлено ли."""
+        self._send = send
+        now = time.time()
+        since = datetime.fromtimestamp(now - self._window, timezone.utc).isoformat()
+        for user_id, sent_at in await load_recent_auto_replies(since):
+            self._last_sent[user_id] = datetime.fromisoformat(sent_at).timestamp()
+        for user_id, due_at in await load_pending_auto_replies():
+            self._pending[user_id] = due_at
+            heapq.heappush(self._heap, (due_at, user_id))
+        logger.info(
+            "Авто-ответы: %d в окне, %d ожидают отправки",
+            len(self._last_sent), len(self._pending),
+        )
+        self._timer = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Остановить таймер; ожидающие остаются в БД до следующего старта."""
+        if self._timer is not None:
+            self._timer.cancel()
+            try:
+                await self._timer
+            except asyncio.CancelledError:
+                pass
+            self._timer = None
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=10)
+
+    async def note_message(self, user_id: int):
+        """Клиент написал: запланировать авто-ответ, если он положен."""
+        if user_id in self._pending:
+            return
+        now = time.time()
+        last = self._last_sent.get(user_id)
+        if last is not None and now - last <= self._window:
+            return
+        due_at = now + self._delay
+        self._pending[user_id] = due_at
+        heapq.heappush(self._heap, (due_at, user_id))
+        await save_pending_auto_reply(user_id, due_at)
+        if self._heap[0][1] == user_id:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due_at, user_id = heapq.heappop(self._heap)
+            if self._pending.get(user_id) != due_at:
+                continue  # устаревшая запись heap
+            task = asyncio.get_running_loop().create_task(self._fire(user_id))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            self._forget_old()
+
+    async def _fire(self, user_id: int):
+        try:
+            ok = await self._send(user_id)
+        except Exception:
+            logger.exception("Ошибка авто-ответа для user %d", user_id)
+            ok = False
+        self._pending.pop(user_id, None)
+        await delete_pending_auto_reply(user_id)
+        if ok:
+            self.sent += 1
+            self._last_sent[user_id] = time.time()
+            await update_auto_reply_time(user_id)
+        else:
+            self.failed += 1
+
+    def _forget_old(self):
+        """Раз в час выбросить из памяти авто-ответы старше окна."""
+        now = time.time()
+        if now - self._last_cleanup < 3600:
+            return
+        self._last_cleanup = now
+        threshold = now - self._window
+        for user_id in [u for u, t in self._last_sent.items() if t < threshold]:
+            del self._last_sent[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "in_window": len(self._last_sent),
+            "sent": self.sent,
+            "failed": self.failed,
+        }
@@ -0,0 +1,85 @@
+"""Фоновые задачи с гарантией порядка по ключу (топику, пользователю)."""
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedTaskRunner:
+    """
+    Выполняет фоновые задачи последовательно в пределах одного ключа
+    и параллельно для разных ключей.
+
+    На каждый ключ с непустой очередью работает один воркер; когда очередь
+    пуста, воркер завершается. Исключения задач логируются и не мешают
+    следующим задачам того же ключа.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._queues: dict[Hashable, deque] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+        self._pending_tags: set[Hashable] = set()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(
+        self,
+        key: Hashable,
+        job: Callable[[], Awaitable],
+        tag: Hashable | None = None,
+    ) -> bool:
+        """
+        Поставить задачу в очередь ключа.
+
+        Если задан tag и задача с таким tag уже ждёт выполнения — новая
+        не ставится (возвращается False).
+        """
+        if tag is not None:
+            if tag in self._pending_tags:
+                return False
+            self._pending_tags.add(tag)
+        self._queues.setdefault(key, deque()).append((job, tag))
+        if key not in self._workers:
+            self._workers[key] = asyncio.get_running_loop().create_task(
+                self._work(key), name=f"{self._name}:{key}"
+            )
+        return True
+
+    async def _work(self, key: Hashable):
+        queue = self._queues[key]
+        try:
+            while queue:
+                job, tag = queue.popleft()
+                self._pending_tags.discard(tag)
+                try:
+                    await job()
+                    self.completed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Ошибка фоновой задачи %s для ключа %s", self._name, key)
+        finally:
+            del self._queues[key]
+            del self._workers[key]
+
+    async def drain(self, timeout: float = 30.0):
+        """Дождаться завершения всех задач (при остановке бота)."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        logger.info("Ожидание %d фоновых очередей %s", len(workers), self._name)
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Фоновые задачи %s отменены по таймауту: %d", self._name, len(pending))
+
+    def stats(self) -> dict:
+        return {
+            "active_keys": len(self._workers),
+            "queued": sum(len(q) for q in self._queues.values()),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
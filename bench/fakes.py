@@ -0,0 +1,375 @@
+"""
+Локальные заменители внешних сервисов для нагрузочных тестов.
+
+FakeTelegram — Bot API по HTTP: getUpdates и webhook, copyMessage(s),
+sendMessage, createForumTopic, pinChatMessage, deleteMessage(s),
+editMessageText/Caption, setMessageReaction. Задержка ответа и доля
+ответов 429 настраиваются. FakeCalink — эндпоинт support/user/info.
+
+Оба сервера — asyncio на stdlib, HTTP/1.1 с keep-alive, без зависимостей.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# handler(method, path, headers, body) → (status, JSON-ответ)
+Handler = Callable[[str, str, dict, bytes], Awaitable[tuple[int, object]]]
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+
+
+class HttpServer:
+    """Минимальный HTTP/1.1-сервер с keep-alive: тело по Content-Length, ответ — JSON."""
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0):
+        self._handler = handler
+        self._host = host
+        self._port = port
+        self._server: asyncio.AbstractServer | None = None
+        self._connections: set[asyncio.StreamWriter] = set()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                method, target = request.decode("latin-1").split()[:2]
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self._handler(method, target, headers, body)
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Остановка сервера посреди long polling — не ошибка
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+
+# ─── Telegram ────────────────────────────────
+
+# Методы, которые не задерживаются и не получают 429: служебные и long polling
+_SERVICE_METHODS = frozenset({"getMe", "getUpdates", "setWebhook", "deleteWebhook", "close", "logOut"})
+
+# observer(method, params, result) — вызывается после успешного ответа
+Observer = Callable[[str, dict, object], None]
+
+
+def _params(headers: dict, target: str, body: bytes) -> dict:
+    """Параметры запроса PTB: form-urlencoded, не-строки закодированы JSON."""
+    raw = dict(parse_qsl(urlsplit(target).query))
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        raw.update(json.loads(body or b"{}"))
+        return raw
+    raw.update(parse_qsl(body.decode()))
+    params = {}
+    for key, value in raw.items():
+        try:
+            params[key] = json.loads(value) if key not in ("text", "caption", "name") else value
+        except (TypeError, ValueError):
+            params[key] = value
+    return params
+
+
+class FakeTelegram:
+    """
+    Заменитель Bot API для одного бота.
+
+    Апдейты ставятся push_update(): в режиме polling их забирает getUpdates,
+    после setWebhook они отправляются POST-запросом на адрес бота. Исходящие
+    методы отвечают через latency ± jitter секунд; с вероятностью error_rate
+    вместо ответа — 429 с retry_after. ID сообщений выдаются по счётчику на чат.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 0,
+    ):
+        self.token = token
+        self.bot_id = int(token.split(":")[0])
+        self.bot_user = {"id": self.bot_id, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._retry_after = retry_after
+        self._random = random.Random(seed)
+        self._server = HttpServer(self._handle)
+        self._message_ids: dict[int, itertools.count] = {}
+        self._update_ids = itertools.count(1)
+        self._updates: list[dict] = []
+        self._has_updates = asyncio.Event()
+        self._webhook: tuple[str, str] | None = None
+        self._posts: set[asyncio.Task] = set()
+        self._observers: list[Observer] = []
+        self.ready = asyncio.Event()
+        # (чат, сообщение) копии → (чат, сообщение) оригинала и обратно
+        self.copies: dict[tuple[int, int], tuple[int, int]] = {}
+        self.copy_of: dict[tuple[int, int], tuple[int, int]] = {}
+        self.threads: dict[tuple[int, int], int | None] = {}
+        self.calls: dict[str, int] = {}
+        self.errors_injected = 0
+
+    @property
+    def url(self) -> str:
+        """Значение TELEGRAM_API_URL для бота."""
+        return self._server.url + "/bot"
+
+    async def start(self):
+        await self._server.start()
+
+    async def stop(self):
+        for task in list(self._posts):
+            task.cancel()
+        await self._server.stop()
+
+    def observe(self, observer: Observer):
+        self._observers.append(observer)
+
+    def new_message_id(self, chat_id: int) -> int:
+        counter = self._message_ids.get(chat_id)
+        if counter is None:
+            counter = self._message_ids[chat_id] = itertools.count(1)
+        return next(counter)
+
+    def push_update(self, update: dict):
+        """Отдать апдейт боту: в очередь getUpdates или POST на webhook."""
+        update["update_id"] = next(self._update_ids)
+        if self._webhook is None:
+            self._updates.append(update)
+            self._has_updates.set()
+            return
+        task = asyncio.get_running_loop().create_task(self._post_update(update))
+        self._posts.add(task)
+        task.add_done_callback(self._posts.discard)
+
+    async def _post_update(self, update: dict):
+        url, secret = self._webhook
+        parts = urlsplit(url)
+        body = json.dumps(update).encode()
+        for _ in range(50):
+            try:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            logger.error("Webhook %s недоступен", url)
+            return
+        try:
+            headers = (
+                f"POST {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                "Content-Type: application/json\r\nConnection: close\r\n"
+                f"Content-Length: {len(body)}\r\n"
+            )
+            if secret:
+                headers += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+            writer.write(headers.encode() + b"\r\n" + body)
+            await writer.drain()
+            status = await reader.readline()
+            if b" 200 " not in status:
+                logger.warning("Webhook ответил %s", status.decode().strip())
+        finally:
+            writer.close()
+
+    async def _handle(self, method: str, target: str, headers: dict, body: bytes) -> tuple[int, object]:
+        path = urlsplit(target).path
+        prefix = f"/bot{self.token}/"
+        if not path.startswith(prefix):
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        name = path[len(prefix):]
+        params = _params(headers, target, body)
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+        if name == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+        if name not in _SERVICE_METHODS:
+            if self._latency or self._jitter:
+                await asyncio.sleep(max(0.0, self._latency + self._random.uniform(-self._jitter, self._jitter)))
+            if self._error_rate and self._random.random() < self._error_rate:
+                self.errors_injected += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self._retry_after}",
+                    "parameters": {"retry_after": self._retry_after},
+                }
+        method_impl = getattr(self, "_m_" + name, None)
+        result = method_impl(params) if method_impl is not None else True
+        for observer in self._observers:
+            observer(name, params, result)
+        return 200, {"ok": True, "result": result}
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        self.ready.set()
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        return self._updates[:int(params.get("limit") or 100)]
+
+    # ─── Методы Bot API ──────────────────────
+
+    def _chat(self, chat_id: int) -> dict:
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+        return {"id": chat_id, "type": "supergroup", "title": "Support", "is_forum": True}
+
+    def _message(self, chat_id: int, message_id: int, thread_id: int | None = None, **fields) -> dict:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self.bot_user,
+            **fields,
+        }
+        if thread_id:
+            message["message_thread_id"] = thread_id
+            message["is_topic_message"] = True
+        return message
+
+    def _m_getMe(self, params: dict) -> dict:
+        return {**self.bot_user, "can_join_groups": True, "can_read_all_group_messages": True,
+                "supports_inline_queries": False}
+
+    def _m_setWebhook(self, params: dict) -> bool:
+        self._webhook = (params["url"], params.get("secret_token") or "")
+        self.ready.set()
+        return True
+
+    def _m_deleteWebhook(self, params: dict) -> bool:
+        self._webhook = None
+        return True
+
+    def _copy(self, params: dict, source_id: int) -> int:
+        chat_id = int(params["chat_id"])
+        message_id = self.new_message_id(chat_id)
+        source = (int(params["from_chat_id"]), source_id)
+        self.copies[(chat_id, message_id)] = source
+        self.copy_of[source] = (chat_id, message_id)
+        self.threads[(chat_id, message_id)] = params.get("message_thread_id")
+        return message_id
+
+    def _m_copyMessage(self, params: dict) -> dict:
+        return {"message_id": self._copy(params, int(params["message_id"]))}
+
+    def _m_copyMessages(self, params: dict) -> list[dict]:
+        return [{"message_id": self._copy(params, int(i))} for i in params["message_ids"]]
+
+    def _m_sendMessage(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        return self._message(
+            chat_id, self.new_message_id(chat_id), params.get("message_thread_id"), text=params.get("text", "")
+        )
+
+    def _m_createForumTopic(self, params: dict) -> dict:
+        # ID топика — ID служебного сообщения о его создании
+        thread_id = self.new_message_id(int(params["chat_id"]))
+        return {"message_thread_id": thread_id, "name": params.get("name", ""), "icon_color": 7322096}
+
+    def _m_editMessageText(self, params: dict) -> dict:
+        return self._message(int(params["chat_id"]), int(params["message_id"]), text=params.get("text", ""))
+
+    def _m_editMessageCaption(self, params: dict) -> dict:
+        return self._message(int(params["chat_id"]), int(params["message_id"]), caption=params.get("caption", ""))
+
+
+# ─── Calink ──────────────────────────────────
+
+class FakeCalink:
+    """
+    Заменитель support/user/info: POST {"telegram": id} → 200 с данными или 404.
+
+    Найдены пользователи, у которых id % 100 < found_percent. Список ID
+    ({"telegram": [...]}) получает список найденных — для микро-батчинга.
+    """
+
+    def __init__(self, latency: float = 0.0, found_percent: int = 50):
+        self._latency = latency
+        self._found_percent = found_percent
+        self._server = HttpServer(self._handle)
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        """Значение CALINK_API_URL для бота."""
+        return self._server.url + "/api/hooks/support/user/info"
+
+    async def start(self):
+        await self._server.start()
+
+    async def stop(self):
+        await self._server.stop()
+
+    def _user(self, telegram_id: int) -> dict | None:
+        if telegram_id % 100 >= self._found_percent:
+            return None
+        return {
+            "uid": telegram_id * 7,
+            "name": f"Мастер {telegram_id}",
+            "grub": f"master{telegram_id}",
+            "tariff": "pro",
+            "telegram": telegram_id,
+        }
+
+    async def _handle(self, method: str, target: str, headers: dict, body: bytes) -> tuple[int, object]:
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        try:
+            telegram = json.loads(body or b"{}")["telegram"]
+        except (ValueError, KeyError):
+            return 400, {"error": "telegram required"}
+        if isinstance(telegram, list):
+            return 200, [user for user in map(self._user, telegram) if user]
+        user = self._user(int(telegram))
+        return (200, user) if user else (404, {"error": "not found"})
@@ -0,0 +1,480 @@
+"""
+Нагрузочный тест бота без живого токена.
+
+Для каждого сценария поднимаются FakeTelegram и FakeCalink, бот запускается
+отдельным процессом (python bot.py) на временной БД и получает апдейты через
+getUpdates или webhook. Задержка — от постановки апдейта до успешного вызова
+Bot API, которым бот его доставил (copyMessage, editMessageText, deleteMessages).
+
+Сценарии:
+    new_users — шторм новых пользователей: топик, карточка, пересылка
+    chatty    — существующие пользователи пишут много сообщений
+    replies   — саппорт пачкой отвечает во всех топиках
+    edits     — саппорт несколько раз подряд правит ответы
+    deletes   — саппорт удаляет ответы через /del
+    mixed     — всё вместе с заданной частотой
+
+Отчёт: апдейтов/с, p50/p95/p99, прирост файла БД. --save-baseline сохраняет
+результат в baselines.json, следующие запуски сравниваются с ним.
+
+    python -m bench.load [сценарий ...] [--users 200] [--mode polling|webhook]
+        [--latency 0.05] [--error-rate 0.01] [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from bench.fakes import FakeCalink, FakeTelegram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+TOKEN = "123456:bench"
+GROUP_ID = -1001234567890
+AGENT = {"id": 777, "is_bot": False, "first_name": "Agent"}
+
+# Лимиты Telegram в боте снимаются, чтобы мерить код, а не rate limiter
+_NO_LIMITS = {
+    "TG_GLOBAL_RATE": "100000",
+    "TG_CHAT_RATE": "100000",
+    "TG_GROUP_PER_MINUTE": "10000000",
+}
+
+# Метрики: больше — хуже (кроме пропускной способности)
+_HIGHER_IS_BETTER = {"updates_per_sec"}
+
+
+# ─── Ожидание доставки ───────────────────────
+
+class Tracker:
+    """
+    Ожидаемые вызовы Bot API. expect() ставит ожидание по ключу, наблюдатель
+    FakeTelegram закрывает его и записывает задержку. Повторный expect по тому
+    же ключу (серия правок) переносит начало отсчёта на последний апдейт.
+    """
+
+    def __init__(self):
+        self._pending: dict[tuple, tuple[float, str | None, asyncio.Future]] = {}
+        self.latencies: list[float] = []
+        self.first: float | None = None
+        self.last: float | None = None
+        self.measuring = False
+
+    def expect(self, key: tuple, text: str | None = None) -> asyncio.Future:
+        now = time.perf_counter()
+        if self.measuring and self.first is None:
+            self.first = now
+        entry = self._pending.get(key)
+        future = entry[2] if entry else asyncio.get_running_loop().create_future()
+        self._pending[key] = (now, text, future)
+        return future
+
+    def __call__(self, method: str, params: dict, result):
+        if method in ("copyMessage", "copyMessages"):
+            source = int(params["from_chat_id"])
+            ids = [params["message_id"]] if method == "copyMessage" else params["message_ids"]
+            copies = [result] if method == "copyMessage" else result
+            for message_id, copy in zip(ids, copies):
+                self._done(("copy", source, int(message_id)), None, copy["message_id"])
+        elif method in ("editMessageText", "editMessageCaption"):
+            text = params.get("text", params.get("caption"))
+            self._done(("edit", int(params["chat_id"]), int(params["message_id"])), text, True)
+        elif method in ("deleteMessage", "deleteMessages"):
+            ids = [params["message_id"]] if method == "deleteMessage" else params["message_ids"]
+            for message_id in ids:
+                self._done(("delete", int(params["chat_id"]), int(message_id)), None, True)
+
+    def _done(self, key: tuple, text: str | None, result):
+        entry = self._pending.get(key)
+        if entry is None or (entry[1] is not None and entry[1] != text):
+            return
+        del self._pending[key]
+        now = time.perf_counter()
+        if self.measuring:
+            self.latencies.append(now - entry[0])
+            self.last = now
+        if not entry[2].done():
+            entry[2].set_result(result)
+
+    def start_measuring(self):
+        self.latencies.clear()
+        self.first = self.last = None
+        self.measuring = True
+
+
+# ─── Действия клиентов и саппорта ────────────
+
+class Driver:
+    """Строит апдейты Telegram от клиентов и саппорта и ждёт их доставки."""
+
+    def __init__(self, fake: FakeTelegram, tracker: Tracker):
+        self._fake = fake
+        self._tracker = tracker
+        self._next_user = 100_000
+        self.topics: dict[int, int] = {}
+        # user_id → ID последней копии его сообщения в топике (на неё отвечает саппорт)
+        self.bot_messages: dict[int, int] = {}
+        # user_id → [(ID ответа саппорта в группе, ID копии у клиента)]
+        self.replies: dict[int, list[tuple[int, int]]] = {}
+        self.sent = 0
+
+    def _push(self, kind: str, message: dict):
+        self.sent += 1
+        self._fake.push_update({kind: message})
+
+    def new_user(self) -> int:
+        self._next_user += 1
+        return self._next_user
+
+    async def user_message(self, user_id: int, text: str = "Здравствуйте, вопрос по записи"):
+        message_id = self._fake.new_message_id(user_id)
+        future = self._tracker.expect(("copy", user_id, message_id))
+        self._push("message", {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+            "text": text,
+        })
+        copy_id = await future
+        self.bot_messages[user_id] = copy_id
+        # Топик знает только бот: берём его из копии сообщения в группе
+        self.topics[user_id] = self._fake.threads[(GROUP_ID, copy_id)]
+
+    def _group_message(self, user_id: int, message_id: int, **fields) -> dict:
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": GROUP_ID, "type": "supergroup", "title": "Support", "is_forum": True},
+            "from": AGENT,
+            "message_thread_id": self.topics[user_id],
+            "is_topic_message": True,
+            **fields,
+        }
+
+    async def agent_reply(self, user_id: int, text: str = "Добрый день! Сейчас проверим."):
+        message_id = self._fake.new_message_id(GROUP_ID)
+        future = self._tracker.expect(("copy", GROUP_ID, message_id))
+        bot_message = self._group_message(user_id, self.bot_messages[user_id], text="копия сообщения клиента")
+        bot_message["from"] = self._fake.bot_user
+        self._push("message", self._group_message(user_id, message_id, text=text, reply_to_message=bot_message))
+        client_id = await future
+        self.replies.setdefault(user_id, []).append((message_id, client_id))
+
+    async def agent_edit(self, user_id: int, times: int = 1):
+        message_id, client_id = self.replies[user_id][-1]
+        text = ""
+        future = None
+        for version in range(1, times + 1):
+            text = f"Добрый день! Проверили, правка {version} ({random.random():.6f})"
+            future = self._tracker.expect(("edit", user_id, client_id), text)
+            self._push("edited_message", self._group_message(
+                user_id, message_id, text=text, edit_date=int(time.time()),
+            ))
+        await future
+
+    async def agent_delete(self, user_id: int):
+        message_id, client_id = self.replies[user_id].pop()
+        replied = self._group_message(user_id, message_id, text="ответ")
+        future = self._tracker.expect(("delete", user_id, client_id))
+        self._push("message", self._group_message(
+            user_id, self._fake.new_message_id(GROUP_ID),
+            text="/del", entities=[{"type": "bot_command", "offset": 0, "length": 4}],
+            reply_to_message=replied,
+        ))
+        await future
+
+
+# ─── Сценарии ────────────────────────────────
+#
+# setup готовит состояние (не замеряется), run возвращает корутины замеряемых
+# действий. Корутины запускаются с частотой --rate (0 — все сразу).
+
+async def _setup_users(driver: Driver, count: int, replies: bool = False) -> list[int]:
+    users = [driver.new_user() for _ in range(count)]
+    await asyncio.gather(*(driver.user_message(u) for u in users))
+    if replies:
+        await asyncio.gather(*(driver.agent_reply(u) for u in users))
+    return users
+
+
+async def scenario_new_users(driver: Driver, args) -> list:
+    return [driver.user_message(driver.new_user()) for _ in range(args.users)]
+
+
+async def scenario_chatty(driver: Driver, args) -> list:
+    users = await _setup_users(driver, args.users)
+    return [
+        driver.user_message(u, f"Сообщение {i}")
+        for i in range(args.messages) for u in users
+    ]
+
+
+async def scenario_replies(driver: Driver, args) -> list:
+    users = await _setup_users(driver, args.users)
+    return [driver.agent_reply(u, f"Ответ {i}") for i in range(args.messages) for u in users]
+
+
+async def scenario_edits(driver: Driver, args) -> list:
+    users = await _setup_users(driver, args.users, replies=True)
+    return [driver.agent_edit(u, times=args.edits) for u in users]
+
+
+async def scenario_deletes(driver: Driver, args) -> list:
+    users = await _setup_users(driver, args.users, replies=True)
+    return [driver.agent_delete(u) for u in users]
+
+
+async def scenario_mixed(driver: Driver, args) -> list:
+    users = await _setup_users(driver, args.users, replies=True)
+    rnd = random.Random(7)
+    actions = []
+    for _ in range(args.users * args.messages):
+        user = rnd.choice(users)
+        roll = rnd.random()
+        if roll < 0.1:
+            actions.append(driver.user_message(driver.new_user()))
+        elif roll < 0.6:
+            actions.append(driver.user_message(user))
+        elif roll < 0.85:
+            actions.append(driver.agent_reply(user))
+        elif roll < 0.95:
+            actions.append(driver.agent_edit(user))
+        elif len(driver.replies[user]) > 1:
+            actions.append(driver.agent_delete(user))
+    return actions
+
+
+SCENARIOS = {
+    "new_users": scenario_new_users,
+    "chatty": scenario_chatty,
+    "replies": scenario_replies,
+    "edits": scenario_edits,
+    "deletes": scenario_deletes,
+    "mixed": scenario_mixed,
+}
+
+
+# ─── Запуск ──────────────────────────────────
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _db_size(path: str) -> int:
+    """Логический размер БД (с учётом WAL): page_count × page_size."""
+    if not os.path.exists(path):
+        return 0
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as db:
+        return db.execute("PRAGMA page_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+
+
+def _bot_env(args, fake: FakeTelegram, calink: FakeCalink, workdir: str) -> dict:
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "SUPPORT_GROUP_ID": str(GROUP_ID),
+        "TELEGRAM_API_URL": fake.url,
+        "CALINK_API_URL": calink.url,
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "TRACE_FILE": os.path.join(workdir, "slow_updates.jsonl"),
+        "METRICS_PORT": "0",
+        "BOT_MODE": args.mode,
+    }
+    if args.mode == "webhook":
+        port = _free_port()
+        env.update({
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "PORT": str(port),
+            "WEBHOOK_SECRET": "bench",
+        })
+    if not args.telegram_limits:
+        env.update(_NO_LIMITS)
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def _paced(actions: list, rate: float, timeout: float) -> int:
+    """Запустить действия с частотой rate в секунду. Возвращает число недоставленных."""
+    tasks = []
+    started = time.perf_counter()
+    for i, action in enumerate(actions):
+        if rate:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(action))
+    if not tasks:
+        return 0
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    return len(pending)
+
+
+async def run_scenario(name: str, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    fake = FakeTelegram(TOKEN, args.latency, args.jitter, args.error_rate, args.retry_after)
+    calink = FakeCalink(args.calink_latency, args.found_percent)
+    tracker = Tracker()
+    fake.observe(tracker)
+    await fake.start()
+    await calink.start()
+
+    env = _bot_env(args, fake, calink, workdir)
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "wb") as log:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "bot.py", cwd=ROOT, env=env, stdout=log, stderr=log,
+        )
+    try:
+        await asyncio.wait_for(fake.ready.wait(), timeout=30)
+        driver = Driver(fake, tracker)
+        actions = await asyncio.wait_for(SCENARIOS[name](driver, args), timeout=args.timeout)
+        db_before = _db_size(env["DB_PATH"])
+        errors_before = fake.errors_injected
+        sent_before = driver.sent
+
+        tracker.start_measuring()
+        lost = await _paced(actions, args.rate, args.timeout)
+        tracker.measuring = False
+        updates = driver.sent - sent_before
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                process.kill()
+        await fake.stop()
+        await calink.stop()
+
+    latencies = sorted(tracker.latencies)
+    elapsed = (tracker.last or 0) - (tracker.first or 0)
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    trace = env["TRACE_FILE"]
+    return {
+        "updates": updates,
+        "delivered": len(latencies),
+        "lost": lost,
+        "updates_per_sec": round(updates / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(cuts[49] * 1000, 1) if cuts else 0.0,
+        "p95_ms": round(cuts[94] * 1000, 1) if cuts else 0.0,
+        "p99_ms": round(cuts[98] * 1000, 1) if cuts else 0.0,
+        "db_growth_kb": round((_db_size(env["DB_PATH"]) - db_before) / 1024, 1),
+        "injected_429": fake.errors_injected - errors_before,
+        "slow_updates": sum(1 for _ in open(trace)) if os.path.exists(trace) else 0,
+        "log": log_path,
+    }
+
+
+# ─── Отчёт и базовые значения ────────────────
+
+_COLUMNS = (
+    "updates", "lost", "updates_per_sec", "p50_ms", "p95_ms", "p99_ms",
+    "db_growth_kb", "injected_429", "slow_updates",
+)
+_COMPARED = ("updates_per_sec", "p50_ms", "p95_ms", "p99_ms", "db_growth_kb")
+
+
+def _compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Метрики, ухудшившиеся больше чем на tolerance относительно baseline."""
+    regressions = []
+    for key in _COMPARED:
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if key in _HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append(f"{key} {old} → {new} ({change:+.0%})")
+    return regressions
+
+
+def _print_result(name: str, result: dict, baseline: dict | None):
+    cells = []
+    for key in _COLUMNS:
+        cell = f"{key}={result[key]}"
+        if baseline and key in _COMPARED and baseline.get(key):
+            cell += f" ({(result[key] - baseline[key]) / baseline[key]:+.0%})"
+        cells.append(cell)
+    print(f"{name:10} " + "  ".join(cells))
+
+
+def _load_baselines(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def main(args) -> int:
+    baselines = _load_baselines(args.baseline)
+    key_suffix = f"@{args.mode}"
+    results = {}
+    failed = False
+    for name in args.scenarios:
+        result = await run_scenario(name, args)
+        results[name + key_suffix] = {k: v for k, v in result.items() if k != "log"}
+        baseline = baselines.get(name + key_suffix)
+        _print_result(name, result, baseline)
+        if result["lost"]:
+            print(f"           недоставлено {result['lost']}, лог бота: {result['log']}")
+        regressions = _compare(result, baseline, args.tolerance) if baseline else []
+        for line in regressions:
+            print(f"           регрессия: {line}")
+        failed = failed or bool(regressions) or bool(result["lost"])
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Базовые значения сохранены: {args.baseline}")
+    return 1 if failed and not args.save_baseline else 0
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="сценарий", help=", ".join(SCENARIOS))
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--users", type=int, default=200, help="пользователей в сценарии")
+    parser.add_argument("--messages", type=int, default=5, help="сообщений/ответов на пользователя")
+    parser.add_argument("--edits", type=int, default=3, help="правок подряд одного ответа")
+    parser.add_argument("--rate", type=float, default=0, help="действий в секунду (0 — все сразу)")
+    parser.add_argument("--timeout", type=float, default=120, help="сколько ждать доставки (сек)")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа Bot API (сек)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="разброс задержки Bot API (сек)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument("--calink-latency", type=float, default=0.05, help="задержка Calink API (сек)")
+    parser.add_argument("--found-percent", type=int, default=50, help="процент пользователей Calink")
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты Telegram в боте")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="переменная окружения бота")
+    parser.add_argument("--baseline", default=BASELINES, help="файл базовых значений")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результат как базовый")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(_parse_args())))
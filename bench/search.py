@@ -0,0 +1,136 @@
+"""
+Задержка /find на большом корпусе.
+
+Создаёт временную БД, заполняет message_texts синтетическими сообщениями
+(по умолчанию 1 000 000) и замеряет search_messages на наборе запросов:
+p50/p95/p99, размер БД и время индексации.
+
+    python -m bench.search [--messages 1000000] [--runs 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-search-"), "bench.db")
+
+import database  # noqa: E402
+
+WORDS = (
+    "тариф оплата подписка счёт возврат карта ошибка вход пароль календарь "
+    "запись клиент встреча напоминание перенос отмена интеграция google "
+    "уведомление ссылка бот оператор ответ вопрос помощь настройка аккаунт "
+    "доступ email телефон расписание слот мастер салон услуга цена скидка "
+    "промокод продление списание чек договор период пробный бесплатный"
+).split()
+
+# Остальная лексика — синтетические слова с распределением Ципфа,
+# чтобы частоты терминов были похожи на живую переписку
+_SYLLABLES = "ба ве ги до ку ла ми но пу ре си та фу хо це ча ша ще эр юн ял".split()
+
+QUERIES = (
+    "тариф", "возврат оплаты", "не приходит уведомление", "google календарь",
+    "промокод", "перенос записи", "списание", "пароль вход", "пробный период",
+    "скидка мастер",
+)
+
+
+def _vocabulary(rnd: random.Random, size: int) -> tuple[list[str], list[float]]:
+    """Слова и накопленные веса: доменные слова вперемешку с синтетическими, вес ~ 1/ранг."""
+    words = {"".join(rnd.choices(_SYLLABLES, k=rnd.randint(2, 4))) for _ in range(size)}
+    vocabulary = sorted(words)
+    rnd.shuffle(vocabulary)
+    for i, word in enumerate(WORDS):
+        vocabulary.insert(20 + i * 40, word)
+    weights, total = [], 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1 / rank
+        weights.append(total)
+    return vocabulary, weights
+
+
+def _fill(path: str, count: int, users: int) -> float:
+    """Записать count сообщений напрямую через sqlite3. Возвращает секунды."""
+    rnd = random.Random(42)
+    vocabulary, weights = _vocabulary(rnd, 30_000)
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, first_name, topic_id) VALUES (?, ?, ?)",
+        ((uid, f"User {uid}", 100_000 + uid) for uid in range(1, users + 1)),
+    )
+    batch = 50_000
+    for start in range(0, count, batch):
+        rows = []
+        for i in range(start, min(start + batch, count)):
+            uid = rnd.randint(1, users)
+            text = " ".join(rnd.choices(vocabulary, cum_weights=weights, k=rnd.randint(4, 30)))
+            rows.append((100_000 + uid, i + 1, uid, text))
+        conn.executemany(
+            "INSERT INTO message_texts (topic_id, group_message_id, user_id, text) "
+            "VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+async def _run(args) -> tuple[float, dict[str, list[float]]]:
+    # Схема — через миграции database.py, наполнение — напрямую
+    await database.init_db()
+    await database.close_db()
+    print(f"Индексация {args.messages} сообщений…")
+    fill_sec = _fill(database.DB_PATH, args.messages, args.users)
+
+    await database.init_db()
+    latencies: dict[str, list[float]] = {q: [] for q in QUERIES}
+    try:
+        for i in range(args.runs):
+            query = QUERIES[i % len(QUERIES)]
+            started = time.perf_counter()
+            await database.search_messages(query, args.limit)
+            latencies[query].append((time.perf_counter() - started) * 1000)
+    finally:
+        await database.close_db()
+    return fill_sec, latencies
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    fill_sec, latencies = asyncio.run(_run(args))
+    size_mb = os.path.getsize(database.DB_PATH) / 1024 / 1024
+    print(f"  {fill_sec:.1f} с ({args.messages / fill_sec:.0f} сообщ/с), БД {size_mb:.0f} МБ")
+    everything = [ms for samples in latencies.values() for ms in samples]
+    print(f"\n{'запрос':<28}{'p50':>9}{'p95':>9}{'p99':>9}  мс")
+    for query, samples in latencies.items():
+        if len(samples) < 2:
+            continue
+        print(
+            f"{query:<28}{_percentile(samples, 50):>9.2f}"
+            f"{_percentile(samples, 95):>9.2f}{_percentile(samples, 99):>9.2f}"
+        )
+    print(
+        f"{'все':<28}{_percentile(everything, 50):>9.2f}"
+        f"{_percentile(everything, 95):>9.2f}{_percentile(everything, 99):>9.2f}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,11 @@
+import html
 import logging
+import os
+import secrets
 
 from telegram import ReactionTypeEmoji, Update
-from telegram.error import TelegramError
+from telegram.constants import BulkRequestLimit
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -17,21 +21,95 @@ from config import (
     WELCOME_MESSAGE_DEFAULT,
     AUTO_REPLY_MESSAGE,
     AUTO_REPLY_DELAY,
+    AUTO_REPLY_WINDOW,
+    MEDIA_GROUP_WINDOW,
+    EDIT_DEBOUNCE_WINDOW,
+    BROADCAST_PAGE_SIZE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_REPORT_INTERVAL,
+    SEARCH_ENABLED,
+    SEARCH_RESULTS,
+    SEARCH_RETENTION_DAYS,
+    RECONCILE_INTERVAL_SEC,
+    RECONCILE_ACTIVE_HOURS,
+    RECONCILE_BATCH_SIZE,
+    RECONCILE_CONCURRENCY,
+    OUTBOX_WORKERS,
+    OUTBOX_BASE_DELAY,
+    OUTBOX_MAX_DELAY,
+    OUTBOX_MAX_ATTEMPTS,
+    METRICS_HOST,
+    METRICS_PORT,
+    METRICS_LOG_INTERVAL,
+    TRACE_SLOW_MS,
+    TRACE_SAMPLE_RATE,
+    TRACE_FILE,
+    TRACE_MAX_BYTES,
+    TRACE_BACKUPS,
+    MAX_CONCURRENT_UPDATES,
+    TG_GLOBAL_RATE,
+    TG_CHAT_RATE,
+    TG_GROUP_PER_MINUTE,
+    TG_MAX_RETRIES,
+    TELEGRAM_API_URL,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    MESSAGE_RETENTION_HOURS,
+    PRUNE_INTERVAL_SEC,
+    PRUNE_CHUNK_SIZE,
+    VACUUM_PAGES,
 )
 from database import (
+    DATA_DIR,
     init_db,
+    close_db,
     get_user,
     create_user,
     get_user_by_topic,
-    should_send_auto_reply,
-    update_auto_reply_time,
     save_message_mapping,
     get_client_message_id,
-    delete_message_mapping,
+    delete_message_mappings,
+    get_topic_mappings,
+    unblock_user,
+    index_message_text,
+    search_messages,
+    rebuild_search_index,
+    prune_message_texts,
+    user_cache_stats,
+    write_behind_stats,
     mark_calink_user,
     save_card_message_id,
+    prune_messages,
+    incremental_vacuum,
+    db_size_report,
 )
-from calink_api import lookup_calink_user, format_user_card
+from auto_reply import AutoReplyScheduler
+from background import KeyedTaskRunner
+from broadcast import Broadcaster
+from edit_coalescer import EditCoalescer, content_hash
+from media_groups import MediaGroupBuffer
+from outbox import Outbox, is_permanent
+from reconciler import CalinkReconciler
+from update_processor import KeyedUpdateProcessor
+from rate_limiter import Priority, PriorityRateLimiter
+from calink_api import (
+    lookup_calink_user,
+    format_user_card,
+    load_cache,
+    start_client,
+    close_client,
+    calink_cache_stats,
+    breaker_stats,
+    pool_stats,
+    lookup_stats,
+)
+from metrics import HANDLER_LATENCY, MetricsServer, log_summary, register_stats, timed
+import tracing
+from tracing import span
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -39,6 +117,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Карточки новых пользователей — вне пути пересылки, по порядку внутри топика
+topic_tasks = KeyedTaskRunner("topic")
+auto_replies = AutoReplyScheduler(AUTO_REPLY_DELAY, AUTO_REPLY_WINDOW)
+# Альбомы: элементы копятся и пересылаются одним copy_messages
+albums = MediaGroupBuffer(MEDIA_GROUP_WINDOW)
+# Правки саппорта: за окно до клиента доходит только последняя версия
+edits = EditCoalescer(EDIT_DEBOUNCE_WINDOW)
+# Пересылки, упавшие с временной ошибкой, — повтор из SQLite
+outbox = Outbox(OUTBOX_WORKERS, OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_MAX_ATTEMPTS)
+# Перепроверка не-Calink пользователей — периодически, пачками
+reconciler = CalinkReconciler(RECONCILE_ACTIVE_HOURS, RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY)
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+broadcaster = Broadcaster(
+    SUPPORT_GROUP_ID, BROADCAST_PAGE_SIZE, BROADCAST_CONCURRENCY, BROADCAST_REPORT_INTERVAL
+)
+
 
 # ─── Helpers ─────────────────────────────────
 
@@ -57,18 +151,33 @@ def _get_reply_target(message):
     return replied_to
 
 
-async def _send_and_pin_card(context, topic_id: int, card_text: str) -> int | None:
+def _search_text(message) -> str | None:
+    """Текст/подпись сообщения для поискового индекса (None, если поиск выключен)."""
+    if not SEARCH_ENABLED:
+        return None
+    return message.text or message.caption
+
+
+async def _index_text(topic_id: int, group_message_id: int, user_id: int, text: str | None):
+    """Положить текст сообщения в поисковый индекс (text из _search_text)."""
+    if text:
+        await index_message_text(topic_id, group_message_id, user_id, text)
+
+
+async def _send_and_pin_card(bot, topic_id: int, card_text: str) -> int | None:
     """Отправить карточку в топик и запинить. Вернуть message_id."""
     try:
-        card_msg = await context.bot.send_message(
+        card_msg = await bot.send_message(
             chat_id=SUPPORT_GROUP_ID,
             message_thread_id=topic_id,
             text=card_text,
             disable_web_page_preview=True,
+            rate_limit_args=Priority.CARD,
         )
-        await context.bot.pin_chat_message(
+        await bot.pin_chat_message(
             chat_id=SUPPORT_GROUP_ID,
             message_id=card_msg.message_id,
+            rate_limit_args=Priority.CARD,
         )
         return card_msg.message_id
     except TelegramError:
@@ -76,8 +185,144 @@ async def _send_and_pin_card(context, topic_id: int, card_text: str) -> int | No
         return None
 
 
+async def _create_user_card(context, user_id: int, topic_id: int, username: str):
+    """Фон: карточка нового пользователя (поиск в Calink + отправка и пин)."""
+    calink_user = await lookup_calink_user(user_id)
+    card_text = format_user_card(calink_user, username)
+    card_id = await _send_and_pin_card(context.bot, topic_id, card_text)
+
+    if card_id:
+        if calink_user:
+            await mark_calink_user(user_id, card_id)
+        else:
+            await save_card_message_id(user_id, card_id)
+
+
+async def _refresh_card(bot, user: dict, calink_user: dict) -> int | None:
+    """
+    Заменить карточку пользователя, найденного в Calink. Вернуть ID новой карточки.
+
+    Старая карточка удаляется только после того, как новая отправлена и
+    запинена: при ошибке в топике остаётся старая, а повтор будет в
+    следующей перепроверке.
+    """
+    card_text = format_user_card(calink_user, user.get("username") or "")
+    card_id = await _send_and_pin_card(bot, user["topic_id"], card_text)
+    if not card_id:
+        return None
+    logger.info("User %d найден в Calink, карточка обновлена", user["user_id"])
+
+    old_card_id = user.get("card_message_id")
+    if old_card_id and old_card_id != card_id:
+        try:
+            await bot.delete_message(
+                chat_id=SUPPORT_GROUP_ID,
+                message_id=old_card_id,
+                rate_limit_args=Priority.CARD,
+            )
+        except TelegramError:
+            logger.warning("Не удалось удалить старую карточку %s", old_card_id)
+    return card_id
+
+
+# ─── Пересылка с повтором через outbox ───────
+
+async def _deliver(bot, entry: dict):
+    """
+    Скопировать сообщение (или альбом — entry["album"]) в чат назначения,
+    записать маппинг и проиндексировать текст — и при прямой отправке,
+    и при повторе из outbox.
+
+    В топик — ставит авто-ответ; клиенту — 👍 на сообщение саппорта.
+    Ошибка копирования пробрасывается, ошибка реакции — нет (иначе повтор
+    продублирует уже доставленное сообщение).
+    """
+    to_topic = entry["dest_chat_id"] == SUPPORT_GROUP_ID
+    album = entry.get("album")
+    if album:
+        sent = await bot.copy_messages(
+            chat_id=entry["dest_chat_id"],
+            from_chat_id=entry["from_chat_id"],
+            message_ids=[message_id for message_id, _ in album],
+            message_thread_id=entry["thread_id"],
+            rate_limit_args=Priority.FORWARD,
+        )
+        copies = [copy.message_id for copy in sent]
+    else:
+        sent = await bot.copy_message(
+            chat_id=entry["dest_chat_id"],
+            from_chat_id=entry["from_chat_id"],
+            message_id=entry["source_message_id"],
+            message_thread_id=entry["thread_id"],
+            rate_limit_args=Priority.FORWARD,
+        )
+        album = [(entry["source_message_id"], entry.get("text"))]
+        copies = [sent.message_id]
+
+    if len(copies) != len(album):
+        # copy_messages пропускает сообщения, которые нельзя скопировать, —
+        # соответствие по позиции тогда ненадёжно
+        logger.warning("Альбом: скопировано %d из %d, маппинг не сохранён", len(copies), len(album))
+        pairs = []
+    else:
+        pairs = list(zip(album, copies))
+
+    for (original_id, text), copy_id in pairs:
+        # В группе: копия клиента ↔ оригинал / оригинал саппорта ↔ копия у клиента
+        group_id, client_id = (copy_id, original_id) if to_topic else (original_id, copy_id)
+        await save_message_mapping(
+            group_message_id=group_id,
+            client_message_id=client_id,
+            user_id=entry["user_id"],
+            topic_id=entry["topic_id"],
+            from_client=to_topic,
+        )
+        await _index_text(entry["topic_id"], group_id, entry["user_id"], text)
+
+    if to_topic:
+        # Авто-ответ: через N секунд, не чаще раза в день
+        await auto_replies.note_message(entry["user_id"])
+        return sent
+
+    try:
+        await bot.set_message_reaction(
+            chat_id=entry["from_chat_id"],
+            message_id=entry["source_message_id"],
+            reaction=[ReactionTypeEmoji("👍")],
+            rate_limit_args=Priority.REACTION,
+        )
+    except TelegramError:
+        logger.warning("Не удалось поставить 👍 на сообщение %d", entry["source_message_id"])
+    return sent
+
+
+async def _forward(bot, entry: dict):
+    """
+    Переслать сразу, а при временной ошибке — через outbox.
+
+    Возвращает отправленное сообщение или None, если пересылка ушла в outbox.
+    Пока в чат назначения есть недоставленное, новое встаёт за ним в очередь.
+    Постоянные ошибки (Forbidden, BadRequest) пробрасываются.
+    """
+    if outbox.has_pending(entry["dest_chat_id"], entry["thread_id"]):
+        await outbox.enqueue(**entry)
+        return None
+    try:
+        return await _deliver(bot, entry)
+    except TelegramError as e:
+        if is_permanent(e):
+            raise
+        logger.warning(
+            "Пересылка %d → %d отложена в outbox: %s",
+            entry["source_message_id"], entry["dest_chat_id"], e,
+        )
+        await outbox.enqueue(**entry, error=e)
+        return None
+
+
 # ─── /start ──────────────────────────────────
 
+@timed(HANDLER_LATENCY)
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Приветствие клиента — персонализированное для пользователей Calink."""
     user_id = update.message.from_user.id
@@ -91,21 +336,22 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, disable_web_page_preview=True)
 
 
-# ─── Авто-ответ (job callback) ───────────────
+# ─── Авто-ответ ──────────────────────────────
 
-async def send_auto_reply(context: ContextTypes.DEFAULT_TYPE):
-    """Отправить авто-ответ пользователю через N секунд."""
-    user_id = context.job.data
+async def send_auto_reply(bot, user_id: int) -> bool:
+    """Отправить авто-ответ пользователю (вызывается планировщиком через N секунд)."""
     try:
-        await context.bot.send_message(chat_id=user_id, text=AUTO_REPLY_MESSAGE, disable_web_page_preview=True)
-        await update_auto_reply_time(user_id)
+        await bot.send_message(chat_id=user_id, text=AUTO_REPLY_MESSAGE, disable_web_page_preview=True)
         logger.info("Авто-ответ отправлен user %d", user_id)
+        return True
     except TelegramError:
         logger.exception("Ошибка авто-ответа для user %d", user_id)
+        return False
 
 
 # ─── Клиент → Группа саппорта ────────────────
 
+@timed(HANDLER_LATENCY)
 async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Клиент пишет боту → бот пересылает в топик группы саппорта."""
     message = update.message
@@ -120,7 +366,7 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     db_user = await get_user(user_id)
 
     if db_user is None:
-        # ── Новый пользователь: создаём топик + карточку ──
+        # ── Новый пользователь: создаём топик, карточка — в фоне ──
         topic_name = first_name
         if username:
             topic_name += f" @{username}"
@@ -137,72 +383,66 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             await message.reply_text("Произошла ошибка. Пожалуйста, попробуйте позже.")
             return
 
-        # Карточка пользователя
-        calink_user = await lookup_calink_user(user_id)
-        card_text = format_user_card(calink_user, username)
-        card_id = await _send_and_pin_card(context, topic_id, card_text)
-
-        if card_id:
-            if calink_user:
-                await mark_calink_user(user_id, card_id)
-            else:
-                await save_card_message_id(user_id, card_id)
+        topic_tasks.submit(topic_id, lambda: _create_user_card(context, user_id, topic_id, username))
     else:
         topic_id = db_user["topic_id"]
+        if db_user.get("blocked_at"):
+            # Пишет снова — значит, разблокировал бота
+            await unblock_user(user_id)
+        # Не-Calink пользователей перепроверяет reconcile_job, не каждое сообщение
+
+    if message.media_group_id:
+        albums.add(
+            user_id,
+            message,
+            lambda messages: _forward_album_to_topic(context, user_id, topic_id, messages),
+        )
+        return
 
-        # ── Существующий не-Calink пользователь: перепроверяем ──
-        if not db_user.get("is_calink_user"):
-            calink_user = await lookup_calink_user(user_id)
-            if calink_user:
-                # Удаляем старую карточку
-                old_card_id = db_user.get("card_message_id")
-                if old_card_id:
-                    try:
-                        await context.bot.delete_message(
-                            chat_id=SUPPORT_GROUP_ID,
-                            message_id=old_card_id,
-                        )
-                    except TelegramError:
-                        logger.warning("Не удалось удалить старую карточку %s", old_card_id)
-
-                # Новая карточка с данными Calink
-                card_text = format_user_card(calink_user, username)
-                card_id = await _send_and_pin_card(context, topic_id, card_text)
-                if card_id:
-                    await mark_calink_user(user_id, card_id)
-                logger.info("User %d найден в Calink, карточка обновлена", user_id)
-
+    # Незавершённый альбом этого клиента уходит раньше следующего сообщения
+    with span("album_flush_wait"):
+        await albums.flush_chat(user_id)
     try:
-        sent = await message.copy(
-            chat_id=SUPPORT_GROUP_ID,
-            message_thread_id=topic_id,
-        )
-        # Сохраняем маппинг: сообщение клиента в группе ↔ оригинал у клиента
-        await save_message_mapping(
-            group_message_id=sent.message_id,
-            client_message_id=message.message_id,
-            user_id=user_id,
-            topic_id=topic_id,
-        )
+        await _forward(context.bot, {
+            "dest_chat_id": SUPPORT_GROUP_ID,
+            "thread_id": topic_id,
+            "from_chat_id": message.chat_id,
+            "source_message_id": message.message_id,
+            "user_id": user_id,
+            "topic_id": topic_id,
+            "text": _search_text(message),
+        })
     except TelegramError:
         logger.exception("Ошибка пересылки в топик для user %d", user_id)
         await message.reply_text("Не удалось отправить сообщение. Попробуйте позже.")
-        return
 
-    # Авто-ответ: через N секунд, не чаще раза в день
-    job_name = f"auto_reply_{user_id}"
-    if not context.job_queue.get_jobs_by_name(job_name):
-        if await should_send_auto_reply(user_id):
-            context.job_queue.run_once(
-                send_auto_reply,
-                when=AUTO_REPLY_DELAY,
-                data=user_id,
-                name=job_name,
-            )
+
+async def _forward_album_to_topic(context, user_id: int, topic_id: int, messages: list):
+    """Переслать альбом клиента в топик одним copy_messages (через outbox, как сообщения)."""
+    try:
+        await _forward(context.bot, _album_entry(SUPPORT_GROUP_ID, topic_id, user_id, user_id, topic_id, messages))
+    except TelegramError:
+        logger.exception("Ошибка пересылки альбома в топик для user %d", user_id)
+        await messages[0].reply_text("Не удалось отправить сообщение. Попробуйте позже.")
+
+
+def _album_entry(dest_chat_id: int, thread_id: int | None, from_chat_id: int,
+                 user_id: int, topic_id: int, messages: list) -> dict:
+    """Пересылка альбома для _forward: источник — первый элемент, остальное — в album."""
+    return {
+        "dest_chat_id": dest_chat_id,
+        "thread_id": thread_id,
+        "from_chat_id": from_chat_id,
+        "source_message_id": messages[0].message_id,
+        "user_id": user_id,
+        "topic_id": topic_id,
+        "album": [(m.message_id, _search_text(m)) for m in messages],
+    }
 
 
 # ─── Саппорт → Клиент (reply на сообщение бота) ─
 
+@timed(HANDLER_LATENCY)
 async def handle_support_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Саппорт отвечает reply на сообщение бота → пересылка клиенту + ✅."""
     message = update.message
@@ -222,38 +462,71 @@ async def handle_support_message(update: Update, context: ContextTypes.DEFAULT_T
     if db_user is None:
         return
 
-    try:
-        sent = await message.copy(chat_id=db_user["user_id"])
-        # Маппинг: сообщение саппорта в группе ↔ сообщение у клиента
-        await save_message_mapping(
-            group_message_id=message.message_id,
-            client_message_id=sent.message_id,
-            user_id=db_user["user_id"],
-            topic_id=topic_id,
+    chat_key = ("topic", topic_id)
+    if message.media_group_id:
+        albums.add(
+            chat_key,
+            message,
+            lambda messages: _forward_album_to_client(context, db_user["user_id"], topic_id, messages),
         )
-        await message.set_reaction(reaction=[ReactionTypeEmoji("👍")])
+        return
+
+    with span("album_flush_wait"):
+        await albums.flush_chat(chat_key)
+    try:
+        await _forward(context.bot, {
+            "dest_chat_id": db_user["user_id"],
+            "thread_id": None,
+            "from_chat_id": message.chat_id,
+            "source_message_id": message.message_id,
+            "user_id": db_user["user_id"],
+            "topic_id": topic_id,
+            "text": _search_text(message),
+        })
     except TelegramError:
         logger.exception("Ошибка пересылки клиенту %d", db_user["user_id"])
 
 
+async def _forward_album_to_client(context, user_id: int, topic_id: int, messages: list):
+    """Переслать альбом саппорта клиенту одним copy_messages + 👍 на первый элемент."""
+    try:
+        await _forward(context.bot, _album_entry(user_id, None, SUPPORT_GROUP_ID, user_id, topic_id, messages))
+    except TelegramError:
+        logger.exception("Ошибка пересылки альбома клиенту %d", user_id)
+
+
 # ─── Редактирование сообщения саппорта → обновление у клиента ─
 
+@timed(HANDLER_LATENCY)
 async def handle_edited_support_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Саппорт редактирует сообщение → бот редактирует у клиента + ✏️."""
+    """Саппорт редактирует сообщение → бот редактирует у клиента + ✏️ (последнюю версию за окно)."""
     message = update.edited_message
     if not message or _is_from_bot(message, context):
         return
     if not message.message_thread_id:
         return
+    if message.text is None and message.caption is None:
+        return  # Медиа без подписи — у клиента нечего править
+
+    key = (message.message_thread_id, message.message_id)
+    digest = content_hash(
+        message.text,
+        message.caption,
+        tuple(e.to_json() for e in message.entities or message.caption_entities),
+    )
+    edits.submit(key, digest, message, lambda key, msg: _apply_support_edit(context, msg))
 
+
+async def _apply_support_edit(context, message) -> bool:
+    """Отредактировать сообщение у клиента. True — у клиента актуальная версия."""
     topic_id = message.message_thread_id
     db_user = await get_user_by_topic(topic_id)
     if db_user is None:
-        return
+        return False
 
     client_msg_id = await get_client_message_id(message.message_id, topic_id)
     if client_msg_id is None:
-        return  # Это сообщение не пересылалось клиенту
+        return False  # Это сообщение не пересылалось клиенту
 
     try:
         # Редактируем текстовое сообщение у клиента
@@ -263,28 +536,90 @@ async def handle_edited_support_message(update: Update, context: ContextTypes.DE
                 message_id=client_msg_id,
                 text=message.text,
                 entities=message.entities,
+                rate_limit_args=Priority.FORWARD,
             )
-        elif message.caption is not None:
+        else:
             await context.bot.edit_message_caption(
                 chat_id=db_user["user_id"],
                 message_id=client_msg_id,
                 caption=message.caption,
                 caption_entities=message.caption_entities,
+                rate_limit_args=Priority.FORWARD,
             )
-        await message.set_reaction(reaction=[ReactionTypeEmoji("✍")])
-        logger.info("Сообщение %d отредактировано у клиента %d", message.message_id, db_user["user_id"])
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.exception("Ошибка редактирования у клиента %d", db_user["user_id"])
+            return False
+        # Содержимое у клиента уже такое же — это не ошибка
     except TelegramError:
         logger.exception("Ошибка редактирования у клиента %d", db_user["user_id"])
+        return False
+
+    # ✍ ставится один раз на сообщение, а не на каждую правку
+    if not edits.was_applied((topic_id, message.message_id)):
+        try:
+            await context.bot.set_message_reaction(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                reaction=[ReactionTypeEmoji("✍")],
+                rate_limit_args=Priority.REACTION,
+            )
+        except TelegramError:
+            logger.warning("Не удалось поставить ✍ на сообщение %d", message.message_id)
+    await _index_text(topic_id, message.message_id, db_user["user_id"], _search_text(message))
+    logger.info("Сообщение %d отредактировано у клиента %d", message.message_id, db_user["user_id"])
+    return True
+
 
+# ─── /del и /purge — удаление сообщений у клиента ─
+
+async def _delete_batched(context, chat_id: int, message_ids: list[int]) -> list[str]:
+    """Удалить сообщения пачками delete_messages (до 100 ID). Возвращает ошибки."""
+    errors = []
+    step = BulkRequestLimit.MAX_LIMIT
+    for i in range(0, len(message_ids), step):
+        chunk = message_ids[i:i + step]
+        try:
+            await context.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+        except TelegramError as e:
+            errors.append(f"{len(chunk)} шт.: {e}")
+    return errors
+
+
+async def _delete_mapped(context, command, db_user: dict, targets: list[tuple[int, int]]) -> list[str]:
+    """
+    Удалить сообщения targets [(group_message_id, client_message_id)] у клиента
+    и в топике вместе с командой, затем их маппинги и тексты для /find
+    одной транзакцией.
+    """
+    topic_id = command.message_thread_id
+    group_ids = [group_id for group_id, _ in targets]
+    errors = []
+
+    # 1. Удаляем у клиента
+    for e in await _delete_batched(context, db_user["user_id"], [client_id for _, client_id in targets]):
+        errors.append(f"клиент: {e}")
+        logger.warning("Не удалось удалить сообщения у клиента %d: %s", db_user["user_id"], e)
+
+    # 2. Удаляем оригиналы в топике и саму команду
+    for e in await _delete_batched(context, SUPPORT_GROUP_ID, group_ids + [command.message_id]):
+        errors.append(f"топик: {e}")
+        logger.warning("Не удалось удалить сообщения в топике %d: %s", topic_id, e)
+
+    # 3. Чистим маппинги и поисковый индекс, отменяем ещё не отправленные правки
+    await delete_message_mappings(topic_id, group_ids)
+    for group_id in group_ids:
+        edits.cancel((topic_id, group_id))
+    return errors
 
-# ─── /del — удаление сообщения у клиента ─────
 
+@timed(HANDLER_LATENCY)
 async def handle_del_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Reply на своё сообщение + /del →
     1. Удалить сообщение у клиента
-    2. Удалить оригинальное сообщение саппорта в топике
-    3. Удалить саму команду /del в топике
+    2. Удалить оригинальное сообщение саппорта и саму команду /del в топике
+    3. Удалить маппинг
     """
     message = update.message
     if not message or not message.message_thread_id:
@@ -311,48 +646,328 @@ async def handle_del_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             pass
         return
 
-    errors = []
+    errors = await _delete_mapped(context, message, db_user, [(target_msg_id, client_msg_id)])
+    if not errors:
+        logger.info("Удалено сообщение %d у клиента %d", target_msg_id, db_user["user_id"])
+    else:
+        logger.warning("Частичное удаление msg %d: %s", target_msg_id, "; ".join(errors))
 
-    # 1. Удаляем у клиента
+
+@timed(HANDLER_LATENCY)
+async def handle_purge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Reply на первое сообщение + /purge [N] →
+    удалить у клиента и в топике N ответов саппорта начиная с него
+    (без N — всё начиная с него). Об ошибках — одна сводка в топике.
+    """
+    message = update.message
+    if not message or not message.message_thread_id:
+        return
+
+    replied_to = _get_reply_target(message)
+    limit = None
+    if context.args:
+        try:
+            limit = int(context.args[0])
+        except ValueError:
+            limit = 0
+    if not replied_to or (limit is not None and limit < 1):
+        await message.reply_text("Ответьте /purge [N] на первое сообщение, которое нужно удалить.")
+        return
+
+    topic_id = message.message_thread_id
+    db_user = await get_user_by_topic(topic_id)
+    if db_user is None:
+        return
+
+    targets = await get_topic_mappings(topic_id, replied_to.message_id, limit)
+    if not targets:
+        try:
+            await message.delete()
+        except TelegramError:
+            pass
+        return
+
+    errors = await _delete_mapped(context, message, db_user, targets)
+    if not errors:
+        logger.info("Удалено %d сообщений у клиента %d", len(targets), db_user["user_id"])
+        return
+    logger.warning("Частичное удаление %d сообщений в топике %d: %s", len(targets), topic_id, "; ".join(errors))
     try:
-        await context.bot.delete_message(
-            chat_id=db_user["user_id"],
-            message_id=client_msg_id,
+        await context.bot.send_message(
+            chat_id=SUPPORT_GROUP_ID,
+            message_thread_id=topic_id,
+            text=f"/purge: {len(targets)} сообщений, есть ошибки:\n" + "\n".join(errors),
         )
-    except TelegramError as e:
-        errors.append(f"клиент: {e}")
-        logger.warning("Не удалось удалить сообщение у клиента %d: %s", db_user["user_id"], e)
+    except TelegramError:
+        logger.exception("Не удалось отправить сводку /purge в топик %d", topic_id)
+
+
+# ─── /broadcast — рассылка всем пользователям ─
+
+@timed(HANDLER_LATENCY)
+async def handle_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reply на сообщение в группе + /broadcast → скопировать его всем пользователям."""
+    message = update.message
+    if not message:
+        return
+
+    source = _get_reply_target(message)
+    if not source:
+        await message.reply_text("Ответьте /broadcast на сообщение, которое нужно разослать.")
+        return
+    if broadcaster.running:
+        await message.reply_text("Рассылка уже идёт, дождитесь её завершения.")
+        return
+
+    status = await message.reply_text("📣 Рассылка запускается…")
+    broadcast_id = await broadcaster.begin(source.message_id, message.message_thread_id, status.message_id)
+    logger.info("Запущена рассылка #%d сообщения %d", broadcast_id, source.message_id)
+
+
+# ─── /find — поиск по истории переписки ──────
+
+def _message_link(topic_id: int, message_id: int) -> str:
+    """Ссылка на сообщение в топике группы саппорта."""
+    internal_id = str(SUPPORT_GROUP_ID).removeprefix("-100")
+    return f"https://t.me/c/{internal_id}/{topic_id}/{message_id}"
+
+
+@timed(HANDLER_LATENCY)
+async def handle_find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <запрос> → лучшие совпадения со ссылками на сообщения в топиках."""
+    message = update.message
+    if not message:
+        return
+    if not SEARCH_ENABLED:
+        await message.reply_text("Поиск выключен (SEARCH_ENABLED=1 в окружении).")
+        return
+    query = " ".join(context.args or ())
+    if not query:
+        await message.reply_text("Использование: /find <слова для поиска>")
+        return
+
+    hits = await search_messages(query, SEARCH_RESULTS)
+    if not hits:
+        await message.reply_text("Ничего не найдено.")
+        return
+
+    lines = []
+    for hit in hits:
+        snippet = (
+            html.escape(hit["snippet"])
+            .replace("\x02", "<b>")
+            .replace("\x03", "</b>")
+        )
+        link = _message_link(hit["topic_id"], hit["group_message_id"])
+        name = html.escape(hit["first_name"] or str(hit["user_id"]))
+        lines.append(f'<a href="{link}">{name}</a>, {hit["created_at"][:10]}\n{snippet}')
+    await message.reply_text(
+        "\n\n".join(lines),
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+    )
 
-    # 2. Удаляем оригинальное сообщение в топике
+
+@timed(HANDLER_LATENCY)
+async def handle_reindex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reindex → пересобрать поисковый индекс из сохранённых текстов."""
+    message = update.message
+    if not message:
+        return
     try:
-        await context.bot.delete_message(
-            chat_id=SUPPORT_GROUP_ID,
-            message_id=target_msg_id,
+        await rebuild_search_index()
+    except Exception:
+        logger.exception("Ошибка пересборки поискового индекса")
+        await message.reply_text("Не удалось пересобрать индекс.")
+        return
+    await message.reply_text("Поисковый индекс пересобран.")
+
+
+# ─── /reverify — перепроверка в Calink по запросу ─
+
+@timed(HANDLER_LATENCY)
+async def handle_reverify_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /reverify в топике → перепроверить клиента этого топика сейчас;
+    вне топика → внеочередной проход по всем активным не-Calink клиентам.
+    """
+    message = update.message
+    if not message:
+        return
+
+    if message.message_thread_id:
+        db_user = await get_user_by_topic(message.message_thread_id)
+        if db_user is None:
+            return
+        if db_user.get("is_calink_user"):
+            await message.reply_text("Клиент уже найден в Calink.")
+            return
+        found = await reconciler.check_user(db_user, lambda u, c: _refresh_card(context.bot, u, c))
+        await message.reply_text("Карточка обновлена." if found else "В Calink не найден.")
+        return
+
+    if reconciler.running:
+        await message.reply_text("Перепроверка уже идёт.")
+        return
+    await message.reply_text("Перепроверка запущена.")
+    # Проход долгий — не держим очередь апдейтов этого чата
+    context.application.create_task(_reverify_all(context, message), update=update)
+
+
+async def _reverify_all(context, message):
+    found = await reconciler.run(lambda u, c: _refresh_card(context.bot, u, c))
+    await message.reply_text(f"Перепроверка завершена, найдено в Calink: {found}.")
+
+
+# ─── Обслуживание БД (job callback) ──────────
+
+@timed(HANDLER_LATENCY)
+async def prune_job(context: ContextTypes.DEFAULT_TYPE):
+    """Удалить старые маппинги, вернуть место ОС и залогировать размер БД."""
+    try:
+        deleted = await prune_messages(MESSAGE_RETENTION_HOURS, PRUNE_CHUNK_SIZE)
+        texts = 0
+        if SEARCH_ENABLED:
+            texts = await prune_message_texts(SEARCH_RETENTION_DAYS, PRUNE_CHUNK_SIZE)
+        freelist = await incremental_vacuum(VACUUM_PAGES)
+        report = await db_size_report()
+        logger.info(
+            "Очистка БД: удалено %d маппингов и %d текстов, свободных страниц %d, размер %s",
+            deleted, texts, freelist, report,
         )
-    except TelegramError as e:
-        errors.append(f"топик: {e}")
-        logger.warning("Не удалось удалить сообщение %d в топике: %s", target_msg_id, e)
+    except Exception:
+        logger.exception("Ошибка очистки БД")
 
-    # 3. Удаляем команду /del
+
+@timed(HANDLER_LATENCY)
+async def reconcile_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая перепроверка не-Calink пользователей."""
     try:
-        await message.delete()
-    except TelegramError as e:
-        errors.append(f"/del: {e}")
+        await reconciler.run(lambda u, c: _refresh_card(context.bot, u, c))
+    except Exception:
+        logger.exception("Ошибка перепроверки Calink")
 
-    # Чистим маппинг
-    await delete_message_mapping(target_msg_id, topic_id)
 
-    if not errors:
-        logger.info("Удалено сообщение %d у клиента %d", target_msg_id, db_user["user_id"])
-    else:
-        logger.warning("Частичное удаление msg %d: %s", target_msg_id, "; ".join(errors))
+async def metrics_log_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая сводка задержек в лог."""
+    log_summary()
 
 
 # ─── Запуск ──────────────────────────────────
 
 async def post_init(application: Application):
-    """Инициализация БД при старте."""
+    """Инициализация БД, HTTP-клиента и прогрев кэша Calink при старте."""
+    tracing.configure(
+        TRACE_SLOW_MS,
+        TRACE_SAMPLE_RATE,
+        TRACE_FILE or os.path.join(DATA_DIR, "slow_updates.jsonl"),
+        TRACE_MAX_BYTES,
+        TRACE_BACKUPS,
+    )
     await init_db()
+    await load_cache()
+    await start_client()
+    await auto_replies.start(lambda user_id: send_auto_reply(application.bot, user_id))
+    await broadcaster.start(application.bot)
+    await outbox.start(lambda entry: _deliver(application.bot, entry))
+    application.job_queue.run_repeating(
+        prune_job, interval=PRUNE_INTERVAL_SEC, first=60, name="prune_messages"
+    )
+    application.job_queue.run_repeating(
+        reconcile_job, interval=RECONCILE_INTERVAL_SEC, first=120, name="reconcile_calink"
+    )
+    _register_metrics(application)
+    if METRICS_PORT:
+        await metrics_server.start()
+    if METRICS_LOG_INTERVAL:
+        application.job_queue.run_repeating(
+            metrics_log_job, interval=METRICS_LOG_INTERVAL, name="metrics_log"
+        )
+
+
+def _register_metrics(application: Application):
+    """Gauge из stats() всех компонентов: очереди, кэши, лимиты, пулы."""
+    register_stats("updates", application.update_processor.stats)
+    register_stats("rate_limiter", application.bot.rate_limiter.stats)
+    register_stats("topic_tasks", topic_tasks.stats)
+    register_stats("auto_replies", auto_replies.stats)
+    register_stats("albums", albums.stats)
+    register_stats("edits", edits.stats)
+    register_stats("outbox", outbox.stats)
+    register_stats("broadcast", broadcaster.stats)
+    register_stats("reconciler", reconciler.stats)
+    register_stats("user_cache", user_cache_stats)
+    register_stats("write_behind", write_behind_stats)
+    register_stats("calink_cache", calink_cache_stats)
+    register_stats("calink_breaker", breaker_stats)
+    register_stats("calink_pool", pool_stats)
+    register_stats("calink_lookup", lookup_stats)
+
+
+async def post_stop(application: Application):
+    """Дождаться фоновых задач, пока бот ещё может отправлять запросы."""
+    await broadcaster.stop()
+    await outbox.stop()
+    await albums.drain()
+    await edits.drain()
+    await auto_replies.stop()
+    await topic_tasks.drain()
+
+
+async def post_shutdown(application: Application):
+    """Закрытие HTTP-клиента, сервера метрик и соединений с БД при остановке."""
+    await metrics_server.stop()
+    await close_client()
+    await close_db()
+
+
+# Типы апдейтов, которые может принять MessageHandler / CommandHandler.
+# Business-апдейты не запрашиваем: бот не подключается к бизнес-аккаунтам
+_MESSAGE_UPDATES = frozenset({
+    Update.MESSAGE,
+    Update.EDITED_MESSAGE,
+    Update.CHANNEL_POST,
+    Update.EDITED_CHANNEL_POST,
+})
+
+# Фильтры, которые сужают набор типов апдейтов
+_FILTER_UPDATES = (
+    (filters.UpdateType.MESSAGE, {Update.MESSAGE}),
+    (filters.UpdateType.EDITED_MESSAGE, {Update.EDITED_MESSAGE}),
+    (filters.UpdateType.MESSAGES, {Update.MESSAGE, Update.EDITED_MESSAGE}),
+    (filters.UpdateType.CHANNEL_POST, {Update.CHANNEL_POST}),
+    (filters.UpdateType.EDITED_CHANNEL_POST, {Update.EDITED_CHANNEL_POST}),
+    (filters.UpdateType.CHANNEL_POSTS, {Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST}),
+    (filters.ChatType.PRIVATE, _MESSAGE_UPDATES - {Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST}),
+    (filters.IS_TOPIC_MESSAGE, {Update.MESSAGE, Update.EDITED_MESSAGE}),
+)
+
+
+def _filter_update_types(flt) -> frozenset:
+    """Какие типы апдейтов может пропустить фильтр (консервативно)."""
+    for known, update_types in _FILTER_UPDATES:
+        if flt is known:
+            return frozenset(update_types)
+    base = getattr(flt, "base_filter", None)
+    if base is not None:
+        left = _filter_update_types(base)
+        if getattr(flt, "and_filter", None) is not None:
+            return left & _filter_update_types(flt.and_filter)
+        if getattr(flt, "or_filter", None) is not None:
+            return left | _filter_update_types(flt.or_filter)
+    return _MESSAGE_UPDATES
+
+
+def _allowed_updates(application: Application) -> list[str]:
+    """Типы апдейтов, которые обрабатывают зарегистрированные хендлеры."""
+    update_types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not isinstance(handler, (MessageHandler, CommandHandler)):
+                return Update.ALL_TYPES
+            update_types |= _filter_update_types(handler.filters)
+    return sorted(update_types)
 
 
 def main():
@@ -361,30 +976,78 @@ def main():
     if not SUPPORT_GROUP_ID:
         raise ValueError("SUPPORT_GROUP_ID не задан! Проверьте файл .env")
 
-    app = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .concurrent_updates(KeyedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .rate_limiter(
+            PriorityRateLimiter(
+                TG_GLOBAL_RATE, TG_CHAT_RATE, TG_GROUP_PER_MINUTE, TG_MAX_RETRIES,
+                group_chat_id=SUPPORT_GROUP_ID,
+            )
+        )
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # Команды — только новые сообщения: правка /purge или /broadcast
+    # не должна запускать команду повторно
+    group_command = filters.Chat(SUPPORT_GROUP_ID) & filters.UpdateType.MESSAGE
 
     # Личка: /start
     app.add_handler(
-        CommandHandler("start", start_command, filters=filters.ChatType.PRIVATE)
+        CommandHandler("start", start_command, filters=filters.ChatType.PRIVATE & filters.UpdateType.MESSAGE)
     )
 
     # Личка: любое сообщение клиента
     app.add_handler(
         MessageHandler(
-            filters.ChatType.PRIVATE & ~filters.COMMAND,
+            filters.ChatType.PRIVATE & ~filters.COMMAND & filters.UpdateType.MESSAGE,
             handle_user_message,
         )
     )
 
-    # Группа: /del (должен быть ДО общего обработчика)
+    # Группа: /del и /purge (должны быть ДО общего обработчика)
     app.add_handler(
         CommandHandler(
             "del",
             handle_del_command,
-            filters=filters.Chat(SUPPORT_GROUP_ID) & filters.IS_TOPIC_MESSAGE,
+            filters=group_command & filters.IS_TOPIC_MESSAGE,
+        )
+    )
+    app.add_handler(
+        CommandHandler(
+            "purge",
+            handle_purge_command,
+            filters=group_command & filters.IS_TOPIC_MESSAGE,
+        )
+    )
+
+    # Группа: /broadcast — в любой теме группы саппорта
+    app.add_handler(
+        CommandHandler(
+            "broadcast",
+            handle_broadcast_command,
+            filters=group_command,
         )
     )
 
+    # Группа: поиск по истории
+    app.add_handler(
+        CommandHandler("find", handle_find_command, filters=group_command)
+    )
+    app.add_handler(
+        CommandHandler("reindex", handle_reindex_command, filters=group_command)
+    )
+
+    # Группа: перепроверка в Calink по запросу
+    app.add_handler(
+        CommandHandler("reverify", handle_reverify_command, filters=group_command)
+    )
+
     # Группа: reply-ответ саппорта → клиенту (только новые, не edited)
     app.add_handler(
         MessageHandler(
@@ -401,8 +1064,30 @@ def main():
         )
     )
 
-    logger.info("Бот запущен")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    allowed_updates = _allowed_updates(app)
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL не задан! Нужен для BOT_MODE=webhook")
+        # Без секрета любой, кто угадает путь, может подделать апдейты группы
+        # (/broadcast, /purge) — тогда секрет случайный, set_webhook получит его
+        webhook_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        if not WEBHOOK_SECRET:
+            logger.info("WEBHOOK_SECRET не задан, используется случайный секрет")
+        # При остановке PTB сначала гасит HTTP-сервер, затем дообрабатывает
+        # очередь апдейтов, затем post_stop дожидается фоновых задач
+        logger.info("Бот запущен (webhook, порт %d), апдейты: %s", WEBHOOK_PORT, allowed_updates)
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=webhook_secret,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        logger.info("Бот запущен (polling), апдейты: %s", allowed_updates)
+        app.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+"""Рассылка сообщения из группы саппорта всем пользователям с продолжением после рестарта."""
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from database import (
+    create_broadcast,
+    load_unfinished_broadcasts,
+    save_broadcast_progress,
+    get_broadcast_recipients,
+    count_broadcast_recipients,
+    mark_users_blocked,
+)
+from rate_limiter import Priority, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять отправку после RetryAfter сверх повторов rate limiter'а
+_RETRY_AFTER_ATTEMPTS = 3
+
+
+class _Progress:
+    __slots__ = ("broadcast_id", "source_message_id", "status_message_id",
+                 "last_user_id", "sent", "failed", "blocked", "remaining", "started", "done_at_start")
+
+    def __init__(self, row: dict):
+        self.broadcast_id = row["broadcast_id"]
+        self.source_message_id = row["source_message_id"]
+        self.status_message_id = row["status_message_id"]
+        self.last_user_id = row["last_user_id"]
+        self.sent = row["sent"]
+        self.failed = row["failed"]
+        self.blocked = row["blocked"]
+        self.remaining = 0
+        self.started = time.monotonic()
+        self.done_at_start = self.done
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+
+class Broadcaster:
+    """
+    Копирует сообщение группы саппорта каждому пользователю из users.
+
+    Получатели читаются страницами по page_size (keyset по user_id), в памяти
+    только текущая страница. Отправки идут параллельно (до concurrency) с
+    приоритетом BROADCAST — живая переписка обгоняет рассылку в rate limiter.
+    После каждой страницы курсор и счётчики пишутся в broadcasts: после
+    рестарта рассылка продолжается со следующей страницы (сообщения текущей
+    страницы могут прийти повторно). Незавершённые рассылки (в том числе
+    прерванные ошибкой) идут по очереди, от старой к новой — при старте и
+    перед каждой новой. Заблокировавшие бота отмечаются в users и больше не
+    получают рассылок. Прогресс и ETA — в статусном сообщении топика.
+    """
+
+    def __init__(self, chat_id: int, page_size: int, concurrency: int, report_interval: float):
+        self._chat_id = chat_id
+        self._page_size = page_size
+        self._concurrency = concurrency
+        self._report_interval = report_interval
+        self._bot = None
+        self._task: asyncio.Task | None = None
+        self._progress: _Progress | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot):
+        """Продолжить незавершённые рассылки, если бот остановился посреди них."""
+        self._bot = bot
+        self._launch()
+
+    async def stop(self):
+        """Прервать рассылку; прогресс последней страницы уже сохранён."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def begin(self, source_message_id: int, thread_id: int | None, status_message_id: int) -> int:
+        """Начать рассылку сообщения source_message_id. Возвращает ID рассылки."""
+        broadcast_id = await create_broadcast(source_message_id, thread_id, status_message_id)
+        self._launch()
+        return broadcast_id
+
+    def _launch(self):
+        self._task = asyncio.get_running_loop().create_task(
+            self._run_unfinished(), name="broadcast"
+        )
+
+    async def _run_unfinished(self):
+        """Провести все незавершённые рассылки по очереди, начиная с самой старой."""
+        for row in await load_unfinished_broadcasts():
+            if row["last_user_id"]:
+                logger.info(
+                    "Продолжаем рассылку #%d с user_id > %d",
+                    row["broadcast_id"], row["last_user_id"],
+                )
+            self._progress = _Progress(row)
+            await self._run(self._progress)
+
+    async def _run(self, p: _Progress):
+        p.remaining = await count_broadcast_recipients(p.last_user_id)
+        reporter = asyncio.get_running_loop().create_task(self._report_loop(p))
+        semaphore = asyncio.Semaphore(self._concurrency)
+        try:
+            while True:
+                page = await get_broadcast_recipients(p.last_user_id, self._page_size)
+                if not page:
+                    break
+                results = await asyncio.gather(*(self._send(p, semaphore, uid) for uid in page))
+                blocked = [uid for uid, result in zip(page, results) if result == "blocked"]
+                p.sent += results.count("sent")
+                p.failed += results.count("failed")
+                p.blocked += len(blocked)
+                p.remaining = max(0, p.remaining - len(page))
+                p.last_user_id = page[-1]
+                if blocked:
+                    await mark_users_blocked(blocked)
+                await save_broadcast_progress(p.broadcast_id, p.last_user_id, p.sent, p.failed, p.blocked)
+            await save_broadcast_progress(
+                p.broadcast_id, p.last_user_id, p.sent, p.failed, p.blocked, finished=True
+            )
+            logger.info(
+                "Рассылка #%d завершена: отправлено %d, ошибок %d, заблокировали %d",
+                p.broadcast_id, p.sent, p.failed, p.blocked,
+            )
+        except Exception:
+            # Прогресс сохранён — рассылка продолжится после рестарта
+            # или перед следующей /broadcast
+            logger.exception("Рассылка #%d прервана ошибкой", p.broadcast_id)
+            return
+        finally:
+            reporter.cancel()
+        await self._report(p, finished=True)
+
+    async def _send(self, p: _Progress, semaphore: asyncio.Semaphore, user_id: int) -> str:
+        async with semaphore:
+            for attempt in range(_RETRY_AFTER_ATTEMPTS + 1):
+                try:
+                    await self._bot.copy_message(
+                        chat_id=user_id,
+                        from_chat_id=self._chat_id,
+                        message_id=p.source_message_id,
+                        rate_limit_args=Priority.BROADCAST,
+                    )
+                    return "sent"
+                except RetryAfter as e:
+                    if attempt >= _RETRY_AFTER_ATTEMPTS:
+                        break
+                    await asyncio.sleep(retry_after_seconds(e.retry_after))
+                except Forbidden:
+                    return "blocked"
+                except TelegramError as e:
+                    logger.warning("Рассылка: не доставлено user %d: %s", user_id, e)
+                    return "failed"
+            return "failed"
+
+    async def _report_loop(self, p: _Progress):
+        while True:
+            await asyncio.sleep(self._report_interval)
+            await self._report(p)
+
+    async def _report(self, p: _Progress, finished: bool = False):
+        elapsed = time.monotonic() - p.started
+        rate = (p.done - p.done_at_start) / elapsed if elapsed > 0 else 0.0
+        text = (
+            f"📣 Рассылка #{p.broadcast_id}"
+            f"{' завершена' if finished else ''}\n"
+            f"Отправлено: {p.sent}, ошибок: {p.failed}, заблокировали бота: {p.blocked}\n"
+            f"Скорость: {rate:.1f} сообщ/с"
+        )
+        if not finished:
+            eta = f"{p.remaining / rate / 60:.0f} мин" if rate > 0 else "—"
+            text += f", осталось ~{p.remaining} ({eta})"
+        try:
+            await self._bot.edit_message_text(
+                chat_id=self._chat_id,
+                message_id=p.status_message_id,
+                text=text,
+            )
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning("Рассылка #%d: не удалось обновить статус: %s", p.broadcast_id, e)
+        except TelegramError as e:
+            logger.warning("Рассылка #%d: не удалось обновить статус: %s", p.broadcast_id, e)
+
+    def stats(self) -> dict:
+        p = self._progress
+        if p is None:
+            return {"running": False}
+        return {
+            "running": self.running,
+            "broadcast_id": p.broadcast_id,
+            "sent": p.sent,
+            "failed": p.failed,
+            "blocked": p.blocked,
+            "remaining": p.remaining,
+        }
@@ -1,9 +1,39 @@
 """Клиент для Calink Support API."""
+import asyncio
+import json
 import logging
+import time
+from collections import OrderedDict, deque
 
 import httpx
 
-from config import CALINK_API_URL, CALINK_API_SECRET
+from config import (
+    CALINK_API_URL,
+    CALINK_API_SECRET,
+    CALINK_CACHE_TTL,
+    CALINK_NEGATIVE_CACHE_TTL,
+    CALINK_CACHE_SIZE,
+    CALINK_CACHE_PERSIST,
+    CALINK_MAX_CONNECTIONS,
+    CALINK_MAX_KEEPALIVE,
+    CALINK_KEEPALIVE_EXPIRY,
+    CALINK_HTTP2,
+    CALINK_BATCH_WINDOW_MS,
+    CALINK_BATCH_MAX_SIZE,
+    CALINK_BREAKER_FAILURES,
+    CALINK_BREAKER_COOLDOWN,
+    CALINK_BREAKER_PROBES,
+    CALINK_SLOW_CALL_SEC,
+    CALINK_TIMEOUT_MIN,
+    CALINK_TIMEOUT_MAX,
+    CALINK_TIMEOUT_MULTIPLIER,
+)
+from database import (
+    load_calink_cache,
+    save_calink_cache_entry,
+    delete_calink_cache_entries,
+)
+from metrics import CALINK_LATENCY, timed
 
 logger = logging.getLogger(__name__)
 
@@ -12,31 +42,337 @@ _HEADERS = {
     "X-Support-Secret": CALINK_API_SECRET,
 }
 
-# Таймаут на запрос — 5 секунд
-_TIMEOUT = httpx.Timeout(5.0)
+# Таймаут на запрос по умолчанию — верхняя граница адаптивного таймаута
+_TIMEOUT = httpx.Timeout(CALINK_TIMEOUT_MAX)
 
 
-async def lookup_calink_user(telegram_id: int) -> dict | None:
+# ─── Circuit breaker и адаптивный таймаут ────
+
+class CalinkUnavailable(Exception):
+    """Circuit breaker разомкнут — запрос к Calink API не выполняется."""
+
+
+class _LatencyTracker:
+    """Скользящее окно задержек успешных запросов для расчёта таймаута."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._min_samples = min_samples
+
+    def add(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self) -> float:
+        """p99 × множитель в пределах [CALINK_TIMEOUT_MIN, CALINK_TIMEOUT_MAX]."""
+        if len(self._samples) < self._min_samples:
+            return CALINK_TIMEOUT_MAX
+        p99 = self.percentile(0.99)
+        return min(CALINK_TIMEOUT_MAX, max(CALINK_TIMEOUT_MIN, p99 * CALINK_TIMEOUT_MULTIPLIER))
+
+
+class _CircuitBreaker:
+    """
+    closed → open после N подряд ошибок или медленных ответов;
+    open → half_open по истечении cooldown; в half_open пропускается
+    не больше probes пробных запросов: успех замыкает цепь, ошибка — размыкает снова.
     """
-    Запросить информацию о пользователе Calink по Telegram ID.
 
-    Возвращает dict с полями uid, name, grub, tariff или None если не найден.
+    def __init__(self, failure_threshold: int, cooldown: float, probes: int):
+        self._failure_threshold = max(1, failure_threshold)
+        self._cooldown = cooldown
+        self._probes = max(1, probes)
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self._cooldown:
+                self.rejected += 1
+                return False
+            self._set_state("half_open")
+        if self.state == "half_open":
+            if self._probes_in_flight >= self._probes:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def record_success(self):
+        if self.state == "half_open":
+            self._probes_in_flight -= 1
+            self._set_state("closed")
+        self._failures = 0
+
+    def record_failure(self):
+        if self.state == "half_open":
+            self._probes_in_flight -= 1
+            self._open()
+            return
+        self._failures += 1
+        if self.state == "closed" and self._failures >= self._failure_threshold:
+            self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        self._set_state("open")
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        log = logger.warning if state == "open" else logger.info
+        log("Calink circuit breaker: %s → %s (ошибок подряд: %d)", self.state, state, self._failures)
+        self.state = state
+        if state != "half_open":
+            self._probes_in_flight = 0
+        if state == "closed":
+            self._failures = 0
+
+
+_breaker = _CircuitBreaker(CALINK_BREAKER_FAILURES, CALINK_BREAKER_COOLDOWN, CALINK_BREAKER_PROBES)
+_latency = _LatencyTracker()
+
+
+def breaker_stats() -> dict:
+    """Состояние circuit breaker и текущий адаптивный таймаут."""
+    return {
+        "state": _breaker.state,
+        "times_opened": _breaker.times_opened,
+        "rejected": _breaker.rejected,
+        "timeout": _latency.timeout(),
+        "latency_p50": _latency.percentile(0.5),
+        "latency_p99": _latency.percentile(0.99),
+    }
+
+
+# ─── HTTP-клиент ─────────────────────────────
+
+# Один клиент на всё приложение: соединения с calink.ru переиспользуются
+# (без DNS/TCP/TLS на каждый запрос). Создаётся в post_init, закрывается
+# в post_shutdown.
+_client: httpx.AsyncClient | None = None
+_requests_total = 0
+_requests_in_flight = 0
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def start_client():
+    """Создать общий HTTP-клиент для Calink API."""
+    global _client
+    if _client is not None:
+        return
+    http2 = CALINK_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("CALINK_HTTP2 включён, но пакет h2 не установлен — используем HTTP/1.1")
+        http2 = False
+    _client = httpx.AsyncClient(
+        timeout=_TIMEOUT,
+        headers=_HEADERS,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=CALINK_MAX_CONNECTIONS,
+            max_keepalive_connections=CALINK_MAX_KEEPALIVE,
+            keepalive_expiry=CALINK_KEEPALIVE_EXPIRY,
+        ),
+    )
+    logger.info(
+        "HTTP-клиент Calink создан: max_connections=%d, keepalive=%d, http2=%s",
+        CALINK_MAX_CONNECTIONS, CALINK_MAX_KEEPALIVE, http2,
+    )
+
+
+async def close_client():
+    """Закрыть общий HTTP-клиент."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _get_client() -> httpx.AsyncClient:
+    if _client is None:
+        await start_client()
+    return _client
+
+
+def pool_stats() -> dict:
+    """Статистика пула соединений с Calink API."""
+    connections = []
+    if _client is not None:
+        # httpx не даёт публичного доступа к пулу httpcore
+        pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+    return {
+        "connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+        "requests_total": _requests_total,
+        "requests_in_flight": _requests_in_flight,
+    }
+
+
+# ─── Кэш ответов ─────────────────────────────
+
+class _LookupCache:
     """
+    TTL-кэш результатов поиска с отдельным TTL для ненайденных (negative cache).
+
+    Хранит (expires_at, data); data=None — пользователь не найден в Calink.
+    Время — wall clock, чтобы записи можно было сохранить в SQLite.
+    """
+
+    def __init__(self, positive_ttl: float, negative_ttl: float, max_size: int):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._max_size = max(1, max_size)
+        self._entries: OrderedDict[int, tuple[float, dict | None]] = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int) -> tuple[bool, dict | None]:
+        """Вернуть (найдено_в_кэше, data)."""
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[telegram_id]
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(telegram_id)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, entry[1]
+
+    def put(self, telegram_id: int, data: dict | None, expires_at: float | None = None) -> float:
+        """Положить результат в кэш, вернуть момент истечения."""
+        if expires_at is None:
+            ttl = self.positive_ttl if data is not None else self.negative_ttl
+            expires_at = time.time() + ttl
+        self._entries[telegram_id] = (expires_at, data)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        return expires_at
+
+    def invalidate(self, telegram_id: int | None = None):
+        if telegram_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(telegram_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+        }
+
+
+_cache = _LookupCache(CALINK_CACHE_TTL, CALINK_NEGATIVE_CACHE_TTL, CALINK_CACHE_SIZE)
+
+
+async def load_cache():
+    """Прогреть кэш из SQLite при старте (если включено CALINK_CACHE_PERSIST)."""
+    if not CALINK_CACHE_PERSIST:
+        return
+    rows = await load_calink_cache(time.time())
+    for telegram_id, data, expires_at in rows:
+        _cache.put(telegram_id, json.loads(data) if data else None, expires_at)
+    logger.info("Кэш Calink загружен: %d записей", len(rows))
+
+
+async def invalidate_calink_user(telegram_id: int | None = None):
+    """Сбросить кэш для пользователя (или весь кэш, если telegram_id не указан)."""
+    _cache.invalidate(telegram_id)
+    if CALINK_CACHE_PERSIST:
+        await delete_calink_cache_entries(telegram_id)
+
+
+def calink_cache_stats() -> dict:
+    """Статистика кэша Calink: размер, попадания, промахи."""
+    return _cache.stats()
+
+
+async def _remember(telegram_id: int, data: dict | None):
+    expires_at = _cache.put(telegram_id, data)
+    if not CALINK_CACHE_PERSIST:
+        return
+    try:
+        await save_calink_cache_entry(
+            telegram_id,
+            json.dumps(data, ensure_ascii=False) if data is not None else None,
+            expires_at,
+        )
+    except Exception:
+        logger.exception("Не удалось сохранить кэш Calink для telegram_id=%d", telegram_id)
+
+
+# ─── Запросы ─────────────────────────────────
+
+async def _post(payload: dict) -> httpx.Response:
+    """POST через circuit breaker с адаптивным таймаутом."""
+    global _requests_total, _requests_in_flight
+    if not _breaker.allow():
+        raise CalinkUnavailable()
+    client = await _get_client()
+    _requests_total += 1
+    _requests_in_flight += 1
+    started = time.monotonic()
+    try:
+        resp = await client.post(
+            CALINK_API_URL,
+            json=payload,
+            timeout=httpx.Timeout(_latency.timeout()),
+        )
+    except BaseException:
+        _breaker.record_failure()
+        raise
+    finally:
+        _requests_in_flight -= 1
+
+    latency = time.monotonic() - started
+    if resp.status_code >= 500 or latency > CALINK_SLOW_CALL_SEC:
+        _breaker.record_failure()
+    else:
+        _latency.add(latency)
+        _breaker.record_success()
+    return resp
+
+
+async def _fetch_one(telegram_id: int) -> dict | None:
+    """Один запрос к API. Ответы 200 и 404 кэшируются; ошибки API — нет."""
     try:
-        async with httpx.AsyncClient(timeout=_TIMEOUT) as client:
-            resp = await client.post(
-                CALINK_API_URL,
-                headers=_HEADERS,
-                json={"telegram": telegram_id},
-            )
+        resp = await _post({"telegram": telegram_id})
 
         if resp.status_code == 200:
             data = resp.json()
             logger.info("Calink user found: uid=%s, grub=%s", data.get("uid"), data.get("grub"))
+            await _remember(telegram_id, data)
             return data
 
         if resp.status_code == 404:
             logger.info("Calink user not found for telegram_id=%d", telegram_id)
+            await _remember(telegram_id, None)
             return None
 
         logger.warning(
@@ -44,11 +380,166 @@ async def lookup_calink_user(telegram_id: int) -> dict | None:
         )
         return None
 
+    except CalinkUnavailable:
+        logger.debug("Calink API недоступен (breaker open), telegram_id=%d", telegram_id)
+        return None
     except httpx.HTTPError:
         logger.exception("Ошибка запроса к Calink API для telegram_id=%d", telegram_id)
         return None
 
 
+class _BatchUnsupported(Exception):
+    """Бэкенд не принимает список telegram ID."""
+
+
+def _parse_batch(payload, telegram_ids: list[int]) -> dict[int, dict]:
+    """
+    Разобрать ответ на пакетный запрос.
+
+    Поддерживаются список объектов с полем telegram и словарь {telegram_id: объект}.
+    """
+    found = {}
+    if isinstance(payload, list):
+        for item in payload:
+            if isinstance(item, dict) and item.get("telegram") is not None:
+                found[int(item["telegram"])] = item
+    elif isinstance(payload, dict):
+        for key, item in payload.items():
+            if isinstance(item, dict) and str(key).lstrip("-").isdigit():
+                found[int(key)] = item
+    else:
+        raise _BatchUnsupported(f"неожиданный ответ: {type(payload).__name__}")
+    return {tid: found[tid] for tid in telegram_ids if tid in found}
+
+
+async def _fetch_many(telegram_ids: list[int]) -> dict[int, dict | None]:
+    """Пакетный запрос; при неподдерживаемом формате — откат на одиночные."""
+    global _batch_enabled
+    try:
+        resp = await _post({"telegram": telegram_ids})
+        if resp.status_code in (400, 404, 405, 422):
+            raise _BatchUnsupported(f"HTTP {resp.status_code}")
+        resp.raise_for_status()
+        found = _parse_batch(resp.json(), telegram_ids)
+    except _BatchUnsupported as e:
+        logger.warning("Calink API не поддерживает пакетные запросы (%s), отключаем батчинг", e)
+        _batch_enabled = False
+    except CalinkUnavailable:
+        return {tid: None for tid in telegram_ids}
+    except (httpx.HTTPError, ValueError):
+        logger.exception("Ошибка пакетного запроса к Calink API (%d ID)", len(telegram_ids))
+    else:
+        for telegram_id in telegram_ids:
+            await _remember(telegram_id, found.get(telegram_id))
+        logger.info("Calink batch: %d ID, найдено %d", len(telegram_ids), len(found))
+        return {tid: found.get(tid) for tid in telegram_ids}
+
+    results = await asyncio.gather(*(_fetch_one(tid) for tid in telegram_ids))
+    return dict(zip(telegram_ids, results))
+
+
+class _Batcher:
+    """
+    Микро-батчинг: копит telegram ID в течение окна и резолвит их одним запросом.
+
+    Пакет уходит по истечении окна или при достижении max_size.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self._window = window
+        self._max_size = max(1, max_size)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self.batches = 0
+        self.batched_ids = 0
+
+    async def submit(self, telegram_id: int) -> dict | None:
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(telegram_id)
+        if future is None:
+            future = loop.create_future()
+            self._pending[telegram_id] = future
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self.batches += 1
+            self.batched_ids += len(batch)
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    @staticmethod
+    async def _run(batch: dict[int, asyncio.Future]):
+        try:
+            results = await _fetch_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for telegram_id, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(telegram_id))
+
+
+_batch_enabled = CALINK_BATCH_WINDOW_MS > 0
+_batcher = _Batcher(CALINK_BATCH_WINDOW_MS / 1000, CALINK_BATCH_MAX_SIZE)
+
+# Single-flight: один запрос на telegram ID, остальные ждут его результата
+_inflight: dict[int, asyncio.Task] = {}
+_coalesced = 0
+
+
+async def _resolve(telegram_id: int) -> dict | None:
+    if _batch_enabled:
+        return await _batcher.submit(telegram_id)
+    return await _fetch_one(telegram_id)
+
+
+@timed(CALINK_LATENCY)
+async def lookup_calink_user(telegram_id: int, refresh: bool = False) -> dict | None:
+    """
+    Запросить информацию о пользователе Calink по Telegram ID.
+
+    Возвращает dict с полями uid, name, grub, tariff или None если не найден.
+    Одновременные запросы одного ID делят один запрос к API.
+    refresh=True — не верить кэшу (перепроверка), результат всё равно кэшируется.
+    """
+    global _coalesced
+    if not refresh:
+        cached, data = _cache.get(telegram_id)
+        if cached:
+            return data
+
+    task = _inflight.get(telegram_id)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_resolve(telegram_id))
+        _inflight[telegram_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(telegram_id, None))
+    else:
+        _coalesced += 1
+    # shield: отмена одного ожидающего не отменяет запрос для остальных
+    return await asyncio.shield(task)
+
+
+def lookup_stats() -> dict:
+    """Статистика single-flight и батчинга."""
+    return {
+        "in_flight_ids": len(_inflight),
+        "coalesced": _coalesced,
+        "batch_enabled": _batch_enabled,
+        "batches": _batcher.batches,
+        "batched_ids": _batcher.batched_ids,
+    }
+
+
 def format_user_card(calink_user: dict | None, username: str = "") -> str:
     """
     Сформировать текст информационной карточки пользователя.
@@ -0,0 +1,151 @@
+"""
+Проверка планов запросов database.py.
+
+Вызывает каждую публичную функцию database.py на временной БД, собирает
+выполненные SQL-выражения и прогоняет их через EXPLAIN QUERY PLAN.
+Падает (exit 1), если запрос читает таблицу полным сканированием
+или если в database.py появилась функция, которой нет в CALLS.
+
+    python check_query_plans.py
+"""
+import asyncio
+import inspect
+import os
+import sqlite3
+import sys
+import tempfile
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="qplan-"), "qplan.db")
+
+import database  # noqa: E402
+
+# Аргументы для каждой публичной функции. ID заведомо не в кэше,
+# чтобы чтения доходили до SQLite.
+CALLS = {
+    "create_user": (900, "Name", "user", 9000),
+    "get_user": (999,),
+    "get_user_by_topic": (9999,),
+    "mark_calink_user": (900, 1),
+    "mark_calink_users": ([(900, 1)],),
+    "get_active_unverified_users": ("2000-01-01 00:00:00", 0, 100),
+    "save_card_message_id": (900, 1),
+    "update_auto_reply_time": (900,),
+    "load_recent_auto_replies": ("2000-01-01",),
+    "load_pending_auto_replies": (),
+    "save_pending_auto_reply": (900, 0.0),
+    "delete_pending_auto_reply": (900,),
+    "save_message_mapping": (1, 2, 900, 9000),
+    "save_message_mappings": ([(3, 4, 900, 9000)],),
+    "get_client_message_id": (999, 9999),
+    "delete_message_mapping": (1, 9000),
+    "get_topic_mappings": (9000, 1, 100),
+    "delete_message_mappings": (9000, [3]),
+    "prune_messages": (72, 100),
+    "incremental_vacuum": (10,),
+    "db_size_report": (),
+    "index_message_text": (9000, 1, 900, "тариф"),
+    "search_messages": ("тариф", 10),
+    "rebuild_search_index": (),
+    "prune_message_texts": (180, 100),
+    "add_outbox_entry": (900, None, -100, 5, 900, 9000, 0.0, None),
+    "load_outbox": (),
+    "update_outbox_attempt": (1, 1, 0.0, "err"),
+    "delete_outbox_entry": (1,),
+    "create_broadcast": (1, None, 2),
+    "load_unfinished_broadcasts": (),
+    "save_broadcast_progress": (1, 900, 1, 0, 0),
+    "get_broadcast_recipients": (0, 100),
+    "count_broadcast_recipients": (0,),
+    "mark_users_blocked": ([999],),
+    "unblock_user": (999,),
+    "load_calink_cache": (0.0,),
+    "save_calink_cache_entry": (900, None, 0.0),
+    "delete_calink_cache_entries": (900,),
+}
+
+# Функции жизненного цикла и служебные — не проверяются
+SKIP = {"init_db", "close_db", "flush_writes", "set_trace_callback"}
+
+# Осознанные полные сканирования: SQL целиком → причина. Точное совпадение,
+# чтобы тот же запрос с условием (count(*) ... WHERE) проверялся как обычно
+ALLOWED_EXACT = {
+    f"SELECT count(*) FROM {table}": "отчёт о размере БД (db_size_report), раз в PRUNE_INTERVAL_SEC"
+    for table in ("users", "messages", "message_texts")
+}
+
+# Осознанные полные сканирования: начало SQL → причина
+ALLOWED_SCANS = {
+    "SELECT telegram_id, data, expires_at FROM calink_cache": "загрузка кэша при старте",
+    "DELETE FROM calink_cache WHERE expires_at": "очистка кэша при старте",
+    "SELECT user_id, last_auto_reply FROM users": "загрузка окна авто-ответов при старте",
+    "SELECT user_id, due_at FROM pending_auto_replies": "загрузка ожидающих авто-ответов при старте",
+    "SELECT broadcast_id, source_message_id": "загрузка незавершённых рассылок при старте",
+    "SELECT id, dest_chat_id, thread_id": "загрузка outbox при старте",
+    "SELECT t.topic_id, t.group_message_id": "поиск /find: сканирует только совпадения FTS5",
+    "SELECT k, v FROM 'main'.'messages_fts_config'": "внутренний запрос FTS5, таблица из пары строк",
+}
+
+_PLANNED = ("SELECT", "UPDATE", "DELETE", "INSERT")
+
+
+def _allowed(sql: str) -> bool:
+    return sql in ALLOWED_EXACT or any(sql.startswith(prefix) for prefix in ALLOWED_SCANS)
+
+
+async def _collect() -> list[str]:
+    public = {
+        name for name, fn in inspect.getmembers(database, inspect.iscoroutinefunction)
+        if not name.startswith("_") and fn.__module__ == database.__name__
+    }
+    missing = public - SKIP - set(CALLS)
+    if missing:
+        raise SystemExit(f"Нет аргументов в CALLS для: {', '.join(sorted(missing))}")
+
+    statements: list[str] = []
+    await database.init_db()
+    await database.set_trace_callback(statements.append)
+    try:
+        for name, args in CALLS.items():
+            await getattr(database, name)(*args)
+        await database.flush_writes()
+    finally:
+        await database.set_trace_callback(None)
+        await database.close_db()
+    return statements
+
+
+def _check(statements: list[str]) -> list[tuple[str, str]]:
+    violations = []
+    seen = set()
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        for sql in statements:
+            sql = " ".join(sql.split())
+            if sql in seen or not sql.upper().startswith(_PLANNED):
+                continue
+            seen.add(sql)
+            scans = [
+                row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")
+                if row[3].startswith("SCAN ") and not _allowed(sql)
+            ]
+            violations.extend((sql, detail) for detail in scans)
+            print(f"{'BAD' if scans else 'ok '} {sql[:100]}")
+    finally:
+        conn.close()
+    return violations
+
+
+def main() -> int:
+    statements = asyncio.run(_collect())
+    violations = _check(statements)
+    if violations:
+        print("\nПолное сканирование таблицы:")
+        for sql, detail in violations:
+            print(f"  {detail}\n    {sql}")
+        return 1
+    print("\nВсе запросы используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,8 +21,140 @@ AUTO_REPLY_MESSAGE = "ok, скоро ответим!"
 # Задержка перед авто-ответом (секунды)
 AUTO_REPLY_DELAY = 5
 
-# Calink API
-CALINK_API_URL = "https://calink.ru/api/hooks/support/user/info"
+# Авто-ответ не чаще раза в N секунд (сутки)
+AUTO_REPLY_WINDOW = 86400
+
+# Calink API (адрес переопределяется для бенчмарков с локальным сервером)
+CALINK_API_URL = os.getenv("CALINK_API_URL", "https://calink.ru/api/hooks/support/user/info")
 CALINK_API_SECRET = os.getenv(
     "CALINK_API_SECRET", "HE110_k3y_f0r_SUPp0rt_h00k"
 )
+
+# SQLite: пул соединений на чтение, busy_timeout (мс), размер page cache (КБ)
+# и кэш подготовленных выражений на соединение
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "3"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "128"))
+
+# Сколько пользователей держать в памяти (LRU-кэш поверх таблицы users)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# Кэш ответов Calink API: TTL найденных / ненайденных пользователей (секунды),
+# максимальный размер и сохранение в SQLite между перезапусками
+CALINK_CACHE_TTL = int(os.getenv("CALINK_CACHE_TTL", "3600"))
+CALINK_NEGATIVE_CACHE_TTL = int(os.getenv("CALINK_NEGATIVE_CACHE_TTL", "600"))
+CALINK_CACHE_SIZE = int(os.getenv("CALINK_CACHE_SIZE", "10000"))
+CALINK_CACHE_PERSIST = os.getenv("CALINK_CACHE_PERSIST", "1") == "1"
+
+# Пул HTTP-соединений с Calink API
+CALINK_MAX_CONNECTIONS = int(os.getenv("CALINK_MAX_CONNECTIONS", "20"))
+CALINK_MAX_KEEPALIVE = int(os.getenv("CALINK_MAX_KEEPALIVE", "10"))
+CALINK_KEEPALIVE_EXPIRY = float(os.getenv("CALINK_KEEPALIVE_EXPIRY", "30"))
+CALINK_HTTP2 = os.getenv("CALINK_HTTP2", "0") == "1"
+
+# Микро-батчинг запросов к Calink: окно сбора ID (мс, 0 — выключено)
+# и максимальный размер пакета. Бэкенд должен принимать {"telegram": [id, ...]}
+CALINK_BATCH_WINDOW_MS = int(os.getenv("CALINK_BATCH_WINDOW_MS", "0"))
+CALINK_BATCH_MAX_SIZE = int(os.getenv("CALINK_BATCH_MAX_SIZE", "50"))
+
+# Circuit breaker для Calink API: после N ошибок или медленных ответов подряд
+# запросы не выполняются cooldown секунд, затем пропускаются пробные
+CALINK_BREAKER_FAILURES = int(os.getenv("CALINK_BREAKER_FAILURES", "5"))
+CALINK_BREAKER_COOLDOWN = float(os.getenv("CALINK_BREAKER_COOLDOWN", "30"))
+CALINK_BREAKER_PROBES = int(os.getenv("CALINK_BREAKER_PROBES", "1"))
+CALINK_SLOW_CALL_SEC = float(os.getenv("CALINK_SLOW_CALL_SEC", "2"))
+
+# Адаптивный таймаут: p99 задержки × множитель в пределах [MIN, MAX] секунд
+CALINK_TIMEOUT_MIN = float(os.getenv("CALINK_TIMEOUT_MIN", "1"))
+CALINK_TIMEOUT_MAX = float(os.getenv("CALINK_TIMEOUT_MAX", "5"))
+CALINK_TIMEOUT_MULTIPLIER = float(os.getenv("CALINK_TIMEOUT_MULTIPLIER", "3"))
+
+# Сколько апдейтов обрабатывать параллельно. Апдейты одного пользователя
+# (личка) или одного топика (группа) всё равно идут строго по порядку
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+# Лимиты Telegram на исходящие запросы: всего в секунду, в один личный чат
+# в секунду, в группу саппорта в минуту (0 — без упреждающего лимита,
+# только паузы по RetryAfter); повторы после RetryAfter.
+# При упоре в лимит группы первыми уходят пересылки клиентов (Priority.FORWARD),
+# карточки и рассылки ждут
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_GROUP_PER_MINUTE = float(os.getenv("TG_GROUP_PER_MINUTE", "20"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+
+# Адрес Bot API (к нему дописывается токен) — для локального сервера или бенчмарков
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Webhook: публичный URL (на Railway по умолчанию — RAILWAY_PUBLIC_DOMAIN),
+# путь, адрес и порт встроенного HTTP-сервера, секрет для X-Telegram-Bot-Api-Secret-Token
+_RAILWAY_DOMAIN = os.getenv("RAILWAY_PUBLIC_DOMAIN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", f"https://{_RAILWAY_DOMAIN}" if _RAILWAY_DOMAIN else "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Отложенная запись маппингов и времени авто-ответа: интервал сброса (мс)
+# и максимальный размер пачки
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "20"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+
+# Хранение маппингов сообщений: сколько часов держать (правки и удаления
+# нужны только в окне Telegram 48 ч), как часто чистить (сек), размер порции
+# удаления и сколько свободных страниц возвращать ОС за один проход
+MESSAGE_RETENTION_HOURS = int(os.getenv("MESSAGE_RETENTION_HOURS", "72"))
+PRUNE_INTERVAL_SEC = int(os.getenv("PRUNE_INTERVAL_SEC", "3600"))
+PRUNE_CHUNK_SIZE = int(os.getenv("PRUNE_CHUNK_SIZE", "1000"))
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", "1000"))
+
+# Сколько ждать остальные элементы альбома после первого (секунды)
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+
+# Окно склейки правок саппорта (секунды): до клиента уходит последняя версия
+EDIT_DEBOUNCE_WINDOW = float(os.getenv("EDIT_DEBOUNCE_WINDOW", "2.0"))
+
+# Рассылка /broadcast: размер страницы получателей (прогресс сохраняется
+# после каждой), число одновременных отправок и период обновления статуса (сек)
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "100"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))
+BROADCAST_REPORT_INTERVAL = float(os.getenv("BROADCAST_REPORT_INTERVAL", "10"))
+
+# Полнотекстовый поиск /find: хранить тексты сообщений (SEARCH_ENABLED=1),
+# сколько результатов показывать и сколько дней хранить тексты
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "0") == "1"
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "10"))
+SEARCH_RETENTION_DAYS = int(os.getenv("SEARCH_RETENTION_DAYS", "180"))
+
+# Перепроверка не-Calink пользователей: период (сек), кого считать активным
+# (писал за последние N часов, не больше MESSAGE_RETENTION_HOURS), размер
+# страницы и число одновременных запросов к Calink
+RECONCILE_INTERVAL_SEC = int(os.getenv("RECONCILE_INTERVAL_SEC", "900"))
+RECONCILE_ACTIVE_HOURS = float(os.getenv("RECONCILE_ACTIVE_HOURS", "24"))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "5"))
+
+# Outbox: повтор пересылок после временных ошибок Telegram — число воркеров,
+# базовая и максимальная задержка backoff (сек), сколько попыток до отказа
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_BASE_DELAY = float(os.getenv("OUTBOX_BASE_DELAY", "1"))
+OUTBOX_MAX_DELAY = float(os.getenv("OUTBOX_MAX_DELAY", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+
+# Метрики Prometheus: порт HTTP-эндпоинта /metrics (0 — выключен) и период
+# сводки задержек в лог (сек, 0 — выключена)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", "0"))
+
+# Самописец медленных апдейтов: порог (мс, 0 — выключен), доля трассируемых
+# апдейтов, файл JSONL (по умолчанию slow_updates.jsonl рядом с БД) и ротация
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
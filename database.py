@@ -1,159 +1,936 @@
+import asyncio
 import aiosqlite
+import json
 import os
 import logging
+import string
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
+from config import (
+    DB_READ_POOL_SIZE,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_STATEMENT_CACHE_SIZE,
+    USER_CACHE_SIZE,
+    WRITE_BEHIND_INTERVAL_MS,
+    WRITE_BEHIND_MAX_BATCH,
+)
+from metrics import DB_LATENCY, timed
+
 logger = logging.getLogger(__name__)
 
-# Railway: volume примонтирован в /data/, локально — рядом с ботом
+# Railway: volume примонтирован в /data/, локально — рядом с ботом.
+# DB_PATH из окружения — для проверок и бенчмарков на временной БД
 DATA_DIR = "/data" if os.path.isdir("/data") else os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(DATA_DIR, "support_bot.db")
+DB_PATH = os.getenv("DB_PATH") or os.path.join(DATA_DIR, "support_bot.db")
 
 
-async def init_db():
-    """Создать таблицы, если не существуют."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                first_name TEXT,
-                username TEXT,
-                topic_id INTEGER NOT NULL,
-                is_calink_user INTEGER DEFAULT 0,
-                card_message_id INTEGER,
-                last_auto_reply TEXT,
-                created_at TEXT DEFAULT (datetime('now'))
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                group_message_id INTEGER NOT NULL,
-                client_message_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                topic_id INTEGER NOT NULL,
-                created_at TEXT DEFAULT (datetime('now')),
-                PRIMARY KEY (group_message_id, topic_id)
-            )
-        """)
-        await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_messages_client
-            ON messages (client_message_id, user_id)
-        """)
-        # Миграции для существующих таблиц
-        for col in ("last_auto_reply TEXT", "is_calink_user INTEGER DEFAULT 0", "card_message_id INTEGER"):
+# ─── Соединения ──────────────────────────────
+
+class _ConnectionManager:
+    """
+    Долгоживущие соединения с БД: одно на запись и небольшой пул на чтение.
+
+    В режиме WAL читатели не блокируются писателем, поэтому поиск маппингов
+    не ждёт в очереди за сохранением. Каждое соединение держит свой кэш
+    подготовленных выражений (cached_statements), так что повторные запросы
+    не парсятся заново.
+    """
+
+    def __init__(self, path: str, read_pool_size: int):
+        self._path = path
+        self._read_pool_size = max(1, read_pool_size)
+        self._writer: aiosqlite.Connection | None = None
+        self._readers: list[aiosqlite.Connection] = []
+        self._read_pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self._path, cached_statements=DB_STATEMENT_CACHE_SIZE)
+        db.row_factory = aiosqlite.Row
+        await db.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        await db.execute("PRAGMA synchronous = NORMAL")
+        await db.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        await db.execute("PRAGMA temp_store = MEMORY")
+        return db
+
+    async def open(self):
+        """Открыть писателя (включает auto_vacuum=INCREMENTAL и WAL) и пул читателей."""
+        if self.is_open:
+            return
+        self._writer = await self._connect()
+        # До WAL: на новом файле auto_vacuum задаётся только до первой записи,
+        # а переключение в WAL уже пишет заголовок — иначе режим останется 0
+        await self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        async with self._writer.execute("PRAGMA journal_mode = WAL") as cursor:
+            mode = (await cursor.fetchone())[0]
+        if mode != "wal":
+            logger.warning("Не удалось включить WAL, journal_mode=%s", mode)
+        for _ in range(self._read_pool_size):
+            reader = await self._connect()
+            await reader.execute("PRAGMA query_only = ON")
+            self._readers.append(reader)
+            self._read_pool.put_nowait(reader)
+
+    async def set_trace_callback(self, callback):
+        """Установить sqlite3 trace callback на все соединения."""
+        self._check_open()
+        for conn in [self._writer, *self._readers]:
+            await conn.set_trace_callback(callback)
+
+    async def close(self):
+        """Закрыть все соединения."""
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for reader in self._readers:
+                await reader.close()
+            self._readers.clear()
+            self._read_pool = asyncio.Queue()
+            await self._writer.close()
+            self._writer = None
+
+    def _check_open(self):
+        if not self.is_open:
+            raise RuntimeError("БД не инициализирована: вызовите init_db()")
+
+    @asynccontextmanager
+    async def read(self):
+        """Взять соединение из пула читателей."""
+        self._check_open()
+        conn = await self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Эксклюзивный доступ к писателю; commit по выходу, rollback при ошибке."""
+        self._check_open()
+        async with self._write_lock:
             try:
-                await db.execute(f"ALTER TABLE users ADD COLUMN {col}")
-            except Exception:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+_db = _ConnectionManager(DB_PATH, DB_READ_POOL_SIZE)
+
+
+# ─── Отложенная запись ───────────────────────
+
+class _WriteBehind:
+    """
+    Очередь отложенной записи: выражения копятся и коммитятся одной
+    транзакцией раз в interval секунд или при накоплении max_batch строк
+    (один fsync на пачку вместо одного на сообщение).
+
+    Пока запись не сброшена, её значение лежит в overlay — читающие
+    функции смотрят туда раньше, чем в БД.
+    """
+
+    # Неудачных попыток подряд, после которых пачка выбрасывается
+    _MAX_FAILURES = 3
+
+    def __init__(self, interval: float, max_batch: int):
+        self._interval = interval
+        self._max_batch = max(1, max_batch)
+        self._queue: list[tuple[int, str, tuple]] = []
+        self._oldest: float | None = None
+        self._seq = 0
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # Держится от снятия очереди до commit: flush() с пустой очередью
+        # дожидается пачки, которую уже пишет другой вызов
+        self._flush_lock = asyncio.Lock()
+        self._failures = 0
+        # overlay: ключ → (seq последней записи, значение)
+        self.mappings: dict[tuple[int, int], tuple[int, int | None]] = {}
+        self.auto_reply: dict[int, tuple[int, str]] = {}
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_size = 0
+        self.flush_latency_total = 0.0
+        self.flush_latency_max = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Остановить цикл и сбросить всё накопленное."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
                 pass
-        await db.commit()
-        logger.info("БД инициализирована: %s", DB_PATH)
+            self._task = None
+        # _flush сам выбрасывает пачку после _MAX_FAILURES неудач подряд,
+        # так что цикл конечен; счётчик сбрасываем, чтобы у остановки
+        # были все попытки, а не остаток от ошибок в работе
+        self._failures = 0
+        while self._queue:
+            if not await self.flush():
+                await asyncio.sleep(self._interval)
+
+    def enqueue(self, sql: str, params: tuple) -> int:
+        """Поставить выражение в очередь, вернуть его порядковый номер."""
+        self._seq += 1
+        self._queue.append((self._seq, sql, params))
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._has_items.set()
+        if len(self._queue) >= self._max_batch:
+            self._full.set()
+        return self._seq
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if len(self._queue) < self._max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self._interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not await self.flush():
+                await asyncio.sleep(self._interval)
+
+    async def flush(self) -> bool:
+        """
+        Записать накопленное одной транзакцией. False — ошибка записи.
+        По возвращении в БД всё, что было поставлено в очередь до вызова.
+        """
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> bool:
+        batch, oldest = self._queue, self._oldest
+        self._queue, self._oldest = [], None
+        self._has_items.clear()
+        self._full.clear()
+        if not batch:
+            return True
+        try:
+            async with _db.write() as db:
+                # Подряд идущие одинаковые выражения — одним executemany
+                group_sql, group_params = None, []
+                for _, sql, params in batch:
+                    if sql != group_sql and group_params:
+                        await db.executemany(group_sql, group_params)
+                        group_params = []
+                    group_sql = sql
+                    group_params.append(params)
+                if group_params:
+                    await db.executemany(group_sql, group_params)
+        except Exception:
+            self._failures += 1
+            if self._failures >= self._MAX_FAILURES:
+                logger.exception(
+                    "Отложенная запись: после %d попыток потеряно %d строк",
+                    self._failures, len(batch),
+                )
+                self._failures = 0
+                self._drop_overlay(batch[-1][0])
+                return False
+            logger.exception("Ошибка отложенной записи, повтор (%d строк)", len(batch))
+            self._queue[:0] = batch
+            self._oldest = oldest
+            self._has_items.set()
+            return False
+
+        self._failures = 0
+        self._drop_overlay(batch[-1][0])
+        latency = time.monotonic() - oldest
+        self.batches += 1
+        self.rows += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.flush_latency_total += latency
+        self.flush_latency_max = max(self.flush_latency_max, latency)
+        return True
+
+    def _drop_overlay(self, up_to_seq: int):
+        """Убрать из overlay записи, которые уже в БД (seq ≤ up_to_seq)."""
+        for overlay in (self.mappings, self.auto_reply):
+            for key in [k for k, (seq, _) in overlay.items() if seq <= up_to_seq]:
+                del overlay[key]
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._queue),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_flush_latency": self.flush_latency_total / self.batches if self.batches else 0.0,
+            "max_flush_latency": self.flush_latency_max,
+        }
+
+
+_write_behind = _WriteBehind(WRITE_BEHIND_INTERVAL_MS / 1000, WRITE_BEHIND_MAX_BATCH)
+
+
+async def flush_writes():
+    """
+    Принудительно сбросить отложенные записи в БД.
+
+    Без @timed: вызывается из других функций модуля, и её время уже входит
+    в их замер (helpbot_db_seconds суммировался бы дважды).
+    """
+    await _write_behind.flush()
+
+
+@timed(DB_LATENCY)
+async def set_trace_callback(callback):
+    """Логировать все SQL-выражения через callback (None — выключить)."""
+    await _db.set_trace_callback(callback)
+
+
+def write_behind_stats() -> dict:
+    """Статистика отложенной записи: очередь, размер пачек, задержка сброса."""
+    return _write_behind.stats()
+
+
+async def _ensure_incremental_vacuum():
+    """
+    Включить auto_vacuum=INCREMENTAL. На существующей БД режим меняется
+    только через VACUUM — это одноразовая перестройка файла.
+    """
+    async with _db.write() as db:
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            mode = (await cursor.fetchone())[0]
+        if mode == 2:
+            return
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        async with db.execute("SELECT count(*) FROM sqlite_master") as cursor:
+            has_schema = (await cursor.fetchone())[0] > 0
+        if has_schema:
+            await db.commit()
+            logger.info("Перестройка БД для auto_vacuum=INCREMENTAL...")
+            await db.execute("VACUUM")
+
+
+# ─── Схема и миграции ───────────────────────
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция выполняется
+# один раз, в своей транзакции вместе с повышением версии. Новые миграции
+# добавляются в конец _MIGRATIONS.
+
+async def _columns(db, table: str) -> set[str]:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def _migration_initial(db):
+    """Исходная схема; на старых БД дописывает недостающие колонки users."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            username TEXT,
+            topic_id INTEGER NOT NULL,
+            is_calink_user INTEGER DEFAULT 0,
+            card_message_id INTEGER,
+            last_auto_reply TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            group_message_id INTEGER NOT NULL,
+            client_message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            topic_id INTEGER NOT NULL,
+            created_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (group_message_id, topic_id)
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_client
+        ON messages (client_message_id, user_id)
+    """)
+    existing = await _columns(db, "users")
+    for col in ("last_auto_reply TEXT", "is_calink_user INTEGER DEFAULT 0", "card_message_id INTEGER"):
+        if col.split()[0] not in existing:
+            await db.execute(f"ALTER TABLE users ADD COLUMN {col}")
+
+
+async def _migration_calink_cache(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS calink_cache (
+            telegram_id INTEGER PRIMARY KEY,
+            data TEXT,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+async def _migration_messages_created_index(db):
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_created
+        ON messages (created_at)
+    """)
+
+
+async def _migration_users_topic_index(db):
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_topic
+        ON users (topic_id)
+    """)
+
+
+async def _migration_users_topic_covering_index(db):
+    """get_user_by_topic читает строку целиком из индекса, без обращения к таблице."""
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_topic_cover
+        ON users (topic_id, first_name, username, is_calink_user,
+                  card_message_id, last_auto_reply)
+    """)
+    await db.execute("DROP INDEX IF EXISTS idx_users_topic")
+
+
+async def _migration_pending_auto_replies(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS pending_auto_replies (
+            user_id INTEGER PRIMARY KEY,
+            due_at REAL NOT NULL
+        )
+    """)
+
+
+async def _migration_messages_topic_index(db):
+    """Выборка диапазона сообщений топика для /purge."""
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_topic
+        ON messages (topic_id, group_message_id, client_message_id)
+    """)
+
+
+async def _migration_broadcasts(db):
+    """Рассылки с сохранённым прогрессом и отметка заблокировавших бота."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY,
+            source_message_id INTEGER NOT NULL,
+            thread_id INTEGER,
+            status_message_id INTEGER,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now')),
+            finished_at TEXT
+        )
+    """)
+    if "blocked_at" not in await _columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN blocked_at TEXT")
+    # get_user_by_topic читает и blocked_at — индекс снова должен покрывать строку
+    await db.execute("DROP INDEX IF EXISTS idx_users_topic_cover")
+    await db.execute("""
+        CREATE INDEX idx_users_topic_cover
+        ON users (topic_id, first_name, username, is_calink_user,
+                  card_message_id, last_auto_reply, blocked_at)
+    """)
+
+
+async def _migration_search_index(db):
+    """
+    Тексты сообщений и полнотекстовый индекс FTS5 над ними.
+
+    messages_fts — external content: сам текст хранится один раз в
+    message_texts, индекс синхронизируется триггерами и пересобирается
+    командой 'rebuild'.
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS message_texts (
+            id INTEGER PRIMARY KEY,
+            topic_id INTEGER NOT NULL,
+            group_message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now')),
+            UNIQUE (topic_id, group_message_id)
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_message_texts_created
+        ON message_texts (created_at)
+    """)
+    await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            text,
+            content='message_texts',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS message_texts_ai AFTER INSERT ON message_texts BEGIN
+            INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS message_texts_ad AFTER DELETE ON message_texts BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS message_texts_au AFTER UPDATE OF text ON message_texts BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+        END
+    """)
+
+
+async def _migration_outbox(db):
+    """Очередь пересылок, которые не удалось выполнить сразу."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            dest_chat_id INTEGER NOT NULL,
+            thread_id INTEGER,
+            from_chat_id INTEGER NOT NULL,
+            source_message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            topic_id INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            UNIQUE (from_chat_id, source_message_id)
+        )
+    """)
+
+
+async def _migration_outbox_text(db):
+    """Текст пересылки в outbox — для поискового индекса после доставки."""
+    if "text" not in await _columns(db, "outbox"):
+        await db.execute("ALTER TABLE outbox ADD COLUMN text TEXT")
+
+
+async def _migration_outbox_album(db):
+    """Альбомы в outbox: JSON [[message_id, text], ...] в порядке альбома."""
+    if "album" not in await _columns(db, "outbox"):
+        await db.execute("ALTER TABLE outbox ADD COLUMN album TEXT")
+
+
+async def _migration_messages_direction(db):
+    """
+    Направление маппинга: 1 — копия сообщения клиента в топике,
+    0 — ответ саппорта, скопированный клиенту, NULL — записано до миграции.
+    /purge удаляет только ответы саппорта, поэтому направление — в индексе.
+    """
+    if "from_client" not in await _columns(db, "messages"):
+        await db.execute("ALTER TABLE messages ADD COLUMN from_client INTEGER")
+    await db.execute("DROP INDEX IF EXISTS idx_messages_topic")
+    await db.execute("""
+        CREATE INDEX idx_messages_topic
+        ON messages (topic_id, group_message_id, from_client, client_message_id)
+    """)
+
+
+_MIGRATIONS = [
+    (1, "исходная схема", _migration_initial),
+    (2, "таблица calink_cache", _migration_calink_cache),
+    (3, "индекс messages.created_at", _migration_messages_created_index),
+    (4, "индекс users.topic_id", _migration_users_topic_index),
+    (5, "покрывающий индекс users.topic_id", _migration_users_topic_covering_index),
+    (6, "таблица pending_auto_replies", _migration_pending_auto_replies),
+    (7, "индекс messages (topic_id, group_message_id)", _migration_messages_topic_index),
+    (8, "таблица broadcasts, users.blocked_at", _migration_broadcasts),
+    (9, "полнотекстовый поиск message_texts + messages_fts", _migration_search_index),
+    (10, "таблица outbox", _migration_outbox),
+    (11, "outbox.text", _migration_outbox_text),
+    (12, "outbox.album", _migration_outbox_album),
+    (13, "messages.from_client", _migration_messages_direction),
+]
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+
+async def _migrate():
+    """Применить недостающие миграции; на актуальной схеме — одно чтение PRAGMA."""
+    async with _db.read() as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+    if version >= SCHEMA_VERSION:
+        logger.info("Схема БД актуальна (v%d)", version)
+        return
+
+    for target, description, migration in _MIGRATIONS:
+        if target <= version:
+            continue
+        started = time.monotonic()
+        async with _db.write() as db:
+            await db.execute("BEGIN")
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {target}")
+        logger.info(
+            "Миграция v%d (%s) применена за %.1f мс",
+            target, description, (time.monotonic() - started) * 1000,
+        )
+
+
+@timed(DB_LATENCY)
+async def init_db():
+    """Открыть соединения и привести схему к актуальной версии."""
+    started = time.monotonic()
+    await _db.open()
+    await _ensure_incremental_vacuum()
+    await _migrate()
+    _write_behind.start()
+    logger.info("БД инициализирована за %.1f мс: %s", (time.monotonic() - started) * 1000, DB_PATH)
+
+
+@timed(DB_LATENCY)
+async def close_db():
+    """Сбросить отложенные записи и закрыть соединения с БД при остановке бота."""
+    await _write_behind.stop()
+    await _db.close()
+    logger.info("БД закрыта")
+
+
+# ─── Кэш пользователей ───────────────────────
+
+class _UserCache:
+    """
+    LRU-кэш строк users с обратным индексом topic_id → user_id.
+
+    Write-through: функции, изменяющие users, сначала пишут в БД,
+    затем обновляют кэш. Наружу отдаются копии строк.
+
+    Строка, прочитанная из БД, могла устареть, пока читатель ждал: запись,
+    закоммиченная между SELECT и put(), обновила бы кэш раньше, чем туда
+    легла старая строка. Поэтому записи повышают поколение, а put() с
+    поколением чтения не кладёт строку пользователя, изменённого позже.
+    Отметки записей хранятся, только пока идут чтения из БД.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max(1, max_size)
+        self._rows: OrderedDict[int, dict] = OrderedDict()
+        self._by_topic: dict[int, int] = {}
+        self._generation = 0
+        self._reads = 0
+        self._written: dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale_skips = 0
+
+    def get(self, user_id: int) -> dict | None:
+        row = self._rows.get(user_id)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._rows.move_to_end(user_id)
+        return dict(row)
+
+    def get_by_topic(self, topic_id: int) -> dict | None:
+        user_id = self._by_topic.get(topic_id)
+        if user_id is None:
+            self.misses += 1
+            return None
+        return self.get(user_id)
+
+    def read_started(self) -> int:
+        """Начало чтения из БД мимо кэша: вернуть поколение для put()."""
+        self._reads += 1
+        return self._generation
+
+    def read_finished(self):
+        self._reads -= 1
+        if self._reads == 0:
+            self._written.clear()
+
+    def put(self, row: dict, generation: int | None = None):
+        """Положить строку; generation — поколение чтения, если строка из БД."""
+        user_id = row["user_id"]
+        if generation is not None and self._written.get(user_id, -1) > generation:
+            self.stale_skips += 1
+            return
+        old = self._rows.pop(user_id, None)
+        if old is not None:
+            self._by_topic.pop(old["topic_id"], None)
+        self._rows[user_id] = dict(row)
+        self._by_topic[row["topic_id"]] = user_id
+        while len(self._rows) > self._max_size:
+            _, evicted = self._rows.popitem(last=False)
+            self._by_topic.pop(evicted["topic_id"], None)
+
+    def update(self, user_id: int, **fields):
+        """Обновить поля закэшированной строки (если она есть в кэше)."""
+        self._generation += 1
+        if self._reads:
+            self._written[user_id] = self._generation
+        row = self._rows.get(user_id)
+        if row is not None:
+            row.update(fields)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "stale_skips": self.stale_skips,
+        }
+
+
+_user_cache = _UserCache(USER_CACHE_SIZE)
+
+
+def user_cache_stats() -> dict:
+    """Статистика кэша пользователей: размер, попадания, промахи."""
+    return _user_cache.stats()
 
 
 # ─── Users ───────────────────────────────────
 
+_USER_COLUMNS = (
+    "user_id, first_name, username, topic_id, "
+    "is_calink_user, card_message_id, last_auto_reply, blocked_at"
+)
+
+
+@timed(DB_LATENCY)
 async def get_user(user_id: int) -> dict | None:
     """Получить пользователя по user_id."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT user_id, first_name, username, topic_id, "
-            "is_calink_user, card_message_id, last_auto_reply "
-            "FROM users WHERE user_id = ?",
-            (user_id,),
-        ) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    generation = _user_cache.read_started()
+    try:
+        async with _db.read() as db:
+            async with db.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE user_id = ?",
+                (user_id,),
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        row = _apply_pending_user_writes(dict(row))
+        _user_cache.put(row, generation)
+        return dict(row)
+    finally:
+        _user_cache.read_finished()
 
 
+@timed(DB_LATENCY)
 async def create_user(user_id: int, first_name: str, username: str, topic_id: int):
     """Создать нового пользователя с привязкой к топику."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.write() as db:
         await db.execute(
             "INSERT INTO users (user_id, first_name, username, topic_id) "
             "VALUES (?, ?, ?, ?)",
             (user_id, first_name, username, topic_id),
         )
-        await db.commit()
+    _user_cache.put({
+        "user_id": user_id,
+        "first_name": first_name,
+        "username": username,
+        "topic_id": topic_id,
+        "is_calink_user": 0,
+        "card_message_id": None,
+        "last_auto_reply": None,
+        "blocked_at": None,
+    })
 
 
+@timed(DB_LATENCY)
 async def get_user_by_topic(topic_id: int) -> dict | None:
     """Найти пользователя по ID топика."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT user_id, first_name, username, topic_id, "
-            "is_calink_user, card_message_id "
-            "FROM users WHERE topic_id = ?",
-            (topic_id,),
-        ) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    cached = _user_cache.get_by_topic(topic_id)
+    if cached is not None:
+        return cached
+    generation = _user_cache.read_started()
+    try:
+        async with _db.read() as db:
+            async with db.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE topic_id = ?",
+                (topic_id,),
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        row = _apply_pending_user_writes(dict(row))
+        _user_cache.put(row, generation)
+        return dict(row)
+    finally:
+        _user_cache.read_finished()
+
+
+def _apply_pending_user_writes(row: dict) -> dict:
+    """Наложить ещё не сброшенное время авто-ответа на строку из БД."""
+    pending = _write_behind.auto_reply.get(row["user_id"])
+    if pending is not None:
+        row["last_auto_reply"] = pending[1]
+    return row
 
 
+@timed(DB_LATENCY)
 async def mark_calink_user(user_id: int, card_message_id: int):
     """Отметить пользователя как найденного в Calink и сохранить ID карточки."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.write() as db:
         await db.execute(
             "UPDATE users SET is_calink_user = 1, card_message_id = ? "
             "WHERE user_id = ?",
             (card_message_id, user_id),
         )
-        await db.commit()
+    _user_cache.update(user_id, is_calink_user=1, card_message_id=card_message_id)
 
 
+@timed(DB_LATENCY)
+async def mark_calink_users(rows: list[tuple[int, int]]):
+    """Отметить пачку пользователей [(user_id, card_message_id)] как найденных в Calink."""
+    async with _db.write() as db:
+        await db.executemany(
+            "UPDATE users SET is_calink_user = 1, card_message_id = ? "
+            "WHERE user_id = ?",
+            [(card_message_id, user_id) for user_id, card_message_id in rows],
+        )
+    for user_id, card_message_id in rows:
+        _user_cache.update(user_id, is_calink_user=1, card_message_id=card_message_id)
+
+
+@timed(DB_LATENCY)
+async def get_active_unverified_users(since: str, after_user_id: int, limit: int) -> list[dict]:
+    """
+    Не-Calink пользователи с сообщениями после since (UTC, 'YYYY-MM-DD HH:MM:SS'),
+    страница по user_id > after_user_id.
+    """
+    await flush_writes()
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT u.user_id, u.username, u.topic_id, u.card_message_id "
+            "FROM users u "
+            "WHERE u.user_id IN (SELECT user_id FROM messages WHERE created_at >= ?) "
+            "AND u.user_id > ? AND u.is_calink_user = 0 "
+            "ORDER BY u.user_id LIMIT ?",
+            (since, after_user_id, limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
 async def save_card_message_id(user_id: int, card_message_id: int):
     """Сохранить ID сообщения-карточки (для не-Calink пользователей)."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.write() as db:
         await db.execute(
             "UPDATE users SET card_message_id = ? WHERE user_id = ?",
             (card_message_id, user_id),
         )
-        await db.commit()
-
-
-async def should_send_auto_reply(user_id: int) -> bool:
-    """Проверить, нужно ли отправить авто-ответ (не чаще раза в день)."""
-    user = await get_user(user_id)
-    if not user or not user.get("last_auto_reply"):
-        return True
-    last = datetime.fromisoformat(user["last_auto_reply"])
-    now = datetime.now(timezone.utc)
-    return (now - last).total_seconds() > 86400
+    _user_cache.update(user_id, card_message_id=card_message_id)
 
 
+@timed(DB_LATENCY)
 async def update_auto_reply_time(user_id: int):
-    """Обновить время последнего авто-ответа."""
+    """Обновить время последнего авто-ответа (отложенная запись)."""
     now = datetime.now(timezone.utc).isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET last_auto_reply = ? WHERE user_id = ?",
-            (now, user_id),
-        )
-        await db.commit()
+    seq = _write_behind.enqueue(
+        "UPDATE users SET last_auto_reply = ? WHERE user_id = ?",
+        (now, user_id),
+    )
+    _write_behind.auto_reply[user_id] = (seq, now)
+    _user_cache.update(user_id, last_auto_reply=now)
+
+
+@timed(DB_LATENCY)
+async def load_recent_auto_replies(since: str) -> list[tuple[int, str]]:
+    """Пользователи с авто-ответом позже since (ISO): (user_id, last_auto_reply)."""
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT user_id, last_auto_reply FROM users WHERE last_auto_reply > ?",
+            (since,),
+        ) as cursor:
+            rows = [tuple(row) for row in await cursor.fetchall()]
+    for user_id, sent_at in list(_write_behind.auto_reply.items()):
+        rows.append((user_id, sent_at[1]))
+    return rows
+
+
+@timed(DB_LATENCY)
+async def load_pending_auto_replies() -> list[tuple[int, float]]:
+    """Запланированные, но не отправленные авто-ответы: (user_id, due_at)."""
+    async with _db.read() as db:
+        async with db.execute("SELECT user_id, due_at FROM pending_auto_replies") as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
+async def save_pending_auto_reply(user_id: int, due_at: float):
+    """Запомнить запланированный авто-ответ (отложенная запись)."""
+    _write_behind.enqueue(
+        "INSERT OR REPLACE INTO pending_auto_replies (user_id, due_at) VALUES (?, ?)",
+        (user_id, due_at),
+    )
+
+
+@timed(DB_LATENCY)
+async def delete_pending_auto_reply(user_id: int):
+    """Убрать авто-ответ из запланированных (отложенная запись)."""
+    _write_behind.enqueue(
+        "DELETE FROM pending_auto_replies WHERE user_id = ?",
+        (user_id,),
+    )
 
 
 # ─── Messages (маппинг group ↔ client) ──────
 
+@timed(DB_LATENCY)
 async def save_message_mapping(
     group_message_id: int,
     client_message_id: int,
     user_id: int,
     topic_id: int,
+    from_client: bool | None = None,
 ):
-    """Сохранить связь group_message_id ↔ client_message_id."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO messages "
-            "(group_message_id, client_message_id, user_id, topic_id) "
-            "VALUES (?, ?, ?, ?)",
-            (group_message_id, client_message_id, user_id, topic_id),
-        )
-        await db.commit()
+    """
+    Сохранить связь group_message_id ↔ client_message_id (отложенная запись).
+
+    from_client — направление: True для копии сообщения клиента в топике,
+    False для ответа саппорта, скопированного клиенту.
+    """
+    seq = _write_behind.enqueue(
+        "INSERT OR REPLACE INTO messages "
+        "(group_message_id, client_message_id, user_id, topic_id, from_client) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (group_message_id, client_message_id, user_id, topic_id, from_client),
+    )
+    _write_behind.mappings[(group_message_id, topic_id)] = (seq, client_message_id)
+
+
+async def save_message_mappings(
+    rows: list[tuple[int, int, int, int]],
+    from_client: bool | None = None,
+):
+    """
+    Сохранить пачку связей (group_message_id, client_message_id, user_id, topic_id).
 
+    Без @timed: каждая строка уже замеряется в save_message_mapping.
+    """
+    for group_message_id, client_message_id, user_id, topic_id in rows:
+        await save_message_mapping(group_message_id, client_message_id, user_id, topic_id, from_client)
 
+
+@timed(DB_LATENCY)
 async def get_client_message_id(group_message_id: int, topic_id: int) -> int | None:
     """Найти client_message_id по group_message_id."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    pending = _write_behind.mappings.get((group_message_id, topic_id))
+    if pending is not None:
+        return pending[1]
+    async with _db.read() as db:
         async with db.execute(
             "SELECT client_message_id FROM messages "
             "WHERE group_message_id = ? AND topic_id = ?",
@@ -163,11 +940,425 @@ async def get_client_message_id(group_message_id: int, topic_id: int) -> int | N
             return row[0] if row else None
 
 
+@timed(DB_LATENCY)
 async def delete_message_mapping(group_message_id: int, topic_id: int):
-    """Удалить запись маппинга."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    """Удалить запись маппинга и текст в поисковом индексе (отложенная запись)."""
+    seq = _write_behind.enqueue(
+        "DELETE FROM messages WHERE group_message_id = ? AND topic_id = ?",
+        (group_message_id, topic_id),
+    )
+    _write_behind.enqueue(
+        "DELETE FROM message_texts WHERE group_message_id = ? AND topic_id = ?",
+        (group_message_id, topic_id),
+    )
+    _write_behind.mappings[(group_message_id, topic_id)] = (seq, None)
+
+
+@timed(DB_LATENCY)
+async def get_topic_mappings(
+    topic_id: int,
+    from_group_message_id: int,
+    limit: int | None = None,
+) -> list[tuple[int, int]]:
+    """
+    Ответы саппорта в топике начиная с from_group_message_id (включительно) по порядку.
+
+    Возвращает [(group_message_id, client_message_id)], не больше limit строк
+    (None — все). Копии сообщений клиента и маппинги без направления
+    (записанные до миграции 13) пропускаются: /purge не должен удалять
+    у клиента его собственные сообщения. Отложенные записи сбрасываются
+    заранее, чтобы выборка видела только что пересланные сообщения.
+    """
+    await flush_writes()
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT group_message_id, client_message_id FROM messages "
+            "WHERE topic_id = ? AND group_message_id >= ? AND from_client = 0 "
+            "ORDER BY group_message_id LIMIT ?",
+            (topic_id, from_group_message_id, -1 if limit is None else limit),
+        ) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
+async def delete_message_mappings(topic_id: int, group_message_ids: list[int]):
+    """
+    Удалить пачку маппингов топика одной транзакцией — вместе с текстами
+    в поисковом индексе (триггер message_texts_ad чистит messages_fts),
+    чтобы /find не находил удалённые сообщения.
+    """
+    await flush_writes()
+    params = [(group_message_id, topic_id) for group_message_id in group_message_ids]
+    async with _db.write() as db:
+        await db.executemany(
             "DELETE FROM messages WHERE group_message_id = ? AND topic_id = ?",
-            (group_message_id, topic_id),
+            params,
+        )
+        await db.executemany(
+            "DELETE FROM message_texts WHERE group_message_id = ? AND topic_id = ?",
+            params,
+        )
+    for group_message_id in group_message_ids:
+        _write_behind.mappings.pop((group_message_id, topic_id), None)
+
+
+@timed(DB_LATENCY)
+async def prune_messages(retention_hours: int, chunk_size: int) -> int:
+    """
+    Удалить маппинги старше retention_hours порциями по chunk_size строк.
+
+    Каждая порция — отдельная транзакция, между ними писатель освобождается.
+    Возвращает число удалённых строк.
+    """
+    total = 0
+    while True:
+        async with _db.write() as db:
+            cursor = await db.execute(
+                "DELETE FROM messages WHERE rowid IN ("
+                "SELECT rowid FROM messages WHERE created_at < datetime('now', ?) LIMIT ?)",
+                (f"-{retention_hours} hours", chunk_size),
+            )
+            deleted = cursor.rowcount
+            await cursor.close()
+        total += deleted
+        if deleted < chunk_size:
+            return total
+        await asyncio.sleep(0)
+
+
+@timed(DB_LATENCY)
+async def incremental_vacuum(pages: int) -> int:
+    """Вернуть ОС до pages свободных страниц и обрезать WAL. Возвращает оставшийся freelist."""
+    async with _db.write() as db:
+        # через execute sqlite3 делает один шаг и освобождает одну страницу
+        await db.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        # WAL-файл тоже сжимаем, иначе освобождённые страницы остаются в нём
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@timed(DB_LATENCY)
+async def db_size_report() -> dict:
+    """Размер БД: страницы, свободные страницы, размер файлов, число строк."""
+    report = {}
+    async with _db.read() as db:
+        for pragma in ("page_size", "page_count", "freelist_count"):
+            async with db.execute(f"PRAGMA {pragma}") as cursor:
+                report[pragma] = (await cursor.fetchone())[0]
+        for table in ("users", "messages", "message_texts"):
+            async with db.execute(f"SELECT count(*) FROM {table}") as cursor:
+                report[f"{table}_rows"] = (await cursor.fetchone())[0]
+    report["db_bytes"] = report["page_size"] * report["page_count"]
+    wal_path = DB_PATH + "-wal"
+    report["wal_bytes"] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    return report
+
+
+# ─── Поиск по тексту сообщений ───────────────
+
+@timed(DB_LATENCY)
+async def index_message_text(topic_id: int, group_message_id: int, user_id: int, text: str):
+    """Добавить (или заменить после правки) текст сообщения в поисковый индекс (отложенная запись)."""
+    _write_behind.enqueue(
+        "INSERT INTO message_texts (topic_id, group_message_id, user_id, text) "
+        "VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (topic_id, group_message_id) DO UPDATE SET text = excluded.text",
+        (topic_id, group_message_id, user_id, text),
+    )
+
+
+# Знаки препинания вокруг слов запроса: «оплаты,» — это слово «оплаты»
+_QUERY_PUNCTUATION = string.punctuation + "«»„“”…—–"
+
+
+def fts_query(text: str) -> str:
+    """
+    Пользовательский запрос → выражение FTS5: все слова, каждое как префикс.
+
+    unicode61 не знает морфологии, поэтому у длинных слов отрезается
+    окончание: «оплаты» ищется как «опла*» и находит «оплата», «оплатой».
+    Токены с цифрами (номера заказов, телефоны, ID) ищутся точно.
+    """
+    terms = []
+    for word in text.lower().split():
+        word = word.strip(_QUERY_PUNCTUATION)
+        if not word:
+            continue
+        if not word.isalpha():
+            terms.append('"{}"'.format(word.replace('"', '""')))
+            continue
+        if len(word) >= 6:
+            word = word[:-2]
+        elif len(word) == 5:
+            word = word[:-1]
+        terms.append('"{}"*'.format(word.replace('"', '""')))
+    return " ".join(terms)
+
+
+@timed(DB_LATENCY)
+async def search_messages(query: str, limit: int) -> list[dict]:
+    """
+    Найти сообщения по тексту, лучшие совпадения первыми (bm25).
+
+    Возвращает topic_id, group_message_id, user_id, first_name, created_at
+    и snippet — фрагмент с совпадениями между \x02 и \x03.
+    """
+    match = fts_query(query)
+    if not match:
+        return []
+    await flush_writes()
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT t.topic_id, t.group_message_id, t.user_id, u.first_name, t.created_at, "
+            "snippet(messages_fts, 0, char(2), char(3), '…', 16) AS snippet "
+            "FROM messages_fts "
+            "JOIN message_texts t ON t.id = messages_fts.rowid "
+            "LEFT JOIN users u ON u.user_id = t.user_id "
+            "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+            (match, limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
+async def rebuild_search_index():
+    """Пересобрать FTS-индекс из message_texts (после сбоя или смены токенайзера)."""
+    await flush_writes()
+    async with _db.write() as db:
+        await db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        await db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+
+
+@timed(DB_LATENCY)
+async def prune_message_texts(retention_days: int, chunk_size: int) -> int:
+    """Удалить тексты старше retention_days порциями по chunk_size строк. Возвращает число строк."""
+    total = 0
+    while True:
+        async with _db.write() as db:
+            cursor = await db.execute(
+                "DELETE FROM message_texts WHERE id IN ("
+                "SELECT id FROM message_texts WHERE created_at < datetime('now', ?) LIMIT ?)",
+                (f"-{retention_days} days", chunk_size),
+            )
+            deleted = cursor.rowcount
+            await cursor.close()
+        total += deleted
+        if deleted < chunk_size:
+            return total
+        await asyncio.sleep(0)
+
+
+# ─── Outbox (пересылки с повтором) ───────────
+
+_OUTBOX_COLUMNS = (
+    "id, dest_chat_id, thread_id, from_chat_id, source_message_id, "
+    "user_id, topic_id, attempts, next_attempt_at, last_error, created_at, text, album"
+)
+
+
+@timed(DB_LATENCY)
+async def add_outbox_entry(
+    dest_chat_id: int,
+    thread_id: int | None,
+    from_chat_id: int,
+    source_message_id: int,
+    user_id: int,
+    topic_id: int,
+    next_attempt_at: float,
+    last_error: str | None,
+    text: str | None = None,
+    album: list[tuple[int, str | None]] | None = None,
+) -> dict | None:
+    """
+    Записать пересылку в outbox. None — это сообщение уже в очереди.
+    text — для поискового индекса (None, если поиск выключен); album —
+    [(message_id, text)] для альбома, source_message_id — его первый элемент.
+    """
+    now = time.time()
+    async with _db.write() as db:
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO outbox (dest_chat_id, thread_id, from_chat_id, "
+            "source_message_id, user_id, topic_id, next_attempt_at, last_error, created_at, text, album) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (dest_chat_id, thread_id, from_chat_id, source_message_id,
+             user_id, topic_id, next_attempt_at, last_error, now, text,
+             json.dumps(album) if album else None),
+        )
+        inserted = cursor.rowcount == 1
+        entry_id = cursor.lastrowid
+        await cursor.close()
+    if not inserted:
+        return None
+    return {
+        "id": entry_id,
+        "dest_chat_id": dest_chat_id,
+        "thread_id": thread_id,
+        "from_chat_id": from_chat_id,
+        "source_message_id": source_message_id,
+        "user_id": user_id,
+        "topic_id": topic_id,
+        "attempts": 0,
+        "next_attempt_at": next_attempt_at,
+        "last_error": last_error,
+        "created_at": now,
+        "text": text,
+        "album": [tuple(item) for item in album] if album else None,
+    }
+
+
+@timed(DB_LATENCY)
+async def load_outbox() -> list[dict]:
+    """Все ожидающие пересылки в порядке постановки (при старте)."""
+    async with _db.read() as db:
+        async with db.execute(f"SELECT {_OUTBOX_COLUMNS} FROM outbox ORDER BY id") as cursor:
+            rows = [dict(row) for row in await cursor.fetchall()]
+    for row in rows:
+        if row["album"]:
+            row["album"] = [tuple(item) for item in json.loads(row["album"])]
+    return rows
+
+
+@timed(DB_LATENCY)
+async def update_outbox_attempt(entry_id: int, attempts: int, next_attempt_at: float, last_error: str):
+    """Записать неудачную попытку и время следующей."""
+    async with _db.write() as db:
+        await db.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, next_attempt_at, last_error, entry_id),
+        )
+
+
+@timed(DB_LATENCY)
+async def delete_outbox_entry(entry_id: int):
+    """Убрать пересылку из outbox (доставлена или отброшена)."""
+    async with _db.write() as db:
+        await db.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+
+# ─── Рассылки ────────────────────────────────
+
+@timed(DB_LATENCY)
+async def create_broadcast(source_message_id: int, thread_id: int | None, status_message_id: int) -> int:
+    """Завести рассылку сообщения source_message_id из группы саппорта. Возвращает ID."""
+    async with _db.write() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (source_message_id, thread_id, status_message_id) "
+            "VALUES (?, ?, ?)",
+            (source_message_id, thread_id, status_message_id),
+        )
+        broadcast_id = cursor.lastrowid
+        await cursor.close()
+    return broadcast_id
+
+
+@timed(DB_LATENCY)
+async def load_unfinished_broadcasts() -> list[dict]:
+    """Незавершённые рассылки (для продолжения после рестарта)."""
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT broadcast_id, source_message_id, thread_id, status_message_id, "
+            "last_user_id, sent, failed, blocked FROM broadcasts "
+            "WHERE finished_at IS NULL ORDER BY broadcast_id"
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
+async def save_broadcast_progress(
+    broadcast_id: int,
+    last_user_id: int,
+    sent: int,
+    failed: int,
+    blocked: int,
+    finished: bool = False,
+):
+    """Сохранить курсор и счётчики рассылки; finished — отметить завершённой."""
+    async with _db.write() as db:
+        await db.execute(
+            "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?, "
+            "finished_at = CASE WHEN ? THEN datetime('now') END "
+            "WHERE broadcast_id = ?",
+            (last_user_id, sent, failed, blocked, finished, broadcast_id),
         )
-        await db.commit()
+
+
+@timed(DB_LATENCY)
+async def get_broadcast_recipients(after_user_id: int, limit: int) -> list[int]:
+    """Следующая страница получателей: user_id > after_user_id, без заблокировавших."""
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT user_id FROM users "
+            "WHERE user_id > ? AND blocked_at IS NULL "
+            "ORDER BY user_id LIMIT ?",
+            (after_user_id, limit),
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
+async def count_broadcast_recipients(after_user_id: int) -> int:
+    """Сколько получателей осталось после after_user_id (для ETA)."""
+    async with _db.read() as db:
+        async with db.execute(
+            "SELECT count(*) FROM users WHERE user_id > ? AND blocked_at IS NULL",
+            (after_user_id,),
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@timed(DB_LATENCY)
+async def mark_users_blocked(user_ids: list[int]):
+    """Отметить пользователей, заблокировавших бота (рассылки их пропускают)."""
+    now = datetime.now(timezone.utc).isoformat()
+    async with _db.write() as db:
+        await db.executemany(
+            "UPDATE users SET blocked_at = ? WHERE user_id = ?",
+            [(now, user_id) for user_id in user_ids],
+        )
+    for user_id in user_ids:
+        _user_cache.update(user_id, blocked_at=now)
+
+
+@timed(DB_LATENCY)
+async def unblock_user(user_id: int):
+    """Снять отметку о блокировке: пользователь снова пишет боту."""
+    async with _db.write() as db:
+        await db.execute("UPDATE users SET blocked_at = NULL WHERE user_id = ?", (user_id,))
+    _user_cache.update(user_id, blocked_at=None)
+
+
+# ─── Кэш Calink API ──────────────────────────
+
+@timed(DB_LATENCY)
+async def load_calink_cache(now: float) -> list[tuple[int, str | None, float]]:
+    """Удалить просроченные записи и вернуть живые (telegram_id, data, expires_at)."""
+    async with _db.write() as db:
+        await db.execute("DELETE FROM calink_cache WHERE expires_at <= ?", (now,))
+        async with db.execute(
+            "SELECT telegram_id, data, expires_at FROM calink_cache"
+        ) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+@timed(DB_LATENCY)
+async def save_calink_cache_entry(telegram_id: int, data: str | None, expires_at: float):
+    """Сохранить результат поиска в Calink (data=None — пользователь не найден)."""
+    async with _db.write() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO calink_cache (telegram_id, data, expires_at) "
+            "VALUES (?, ?, ?)",
+            (telegram_id, data, expires_at),
+        )
+
+
+@timed(DB_LATENCY)
+async def delete_calink_cache_entries(telegram_id: int | None = None):
+    """Удалить запись кэша Calink (или все записи, если telegram_id не указан)."""
+    async with _db.write() as db:
+        if telegram_id is None:
+            await db.execute("DELETE FROM calink_cache")
+        else:
+            await db.execute(
+                "DELETE FROM calink_cache WHERE telegram_id = ?", (telegram_id,)
+            )
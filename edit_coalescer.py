@@ -0,0 +1,111 @@
+"""Склейка частых правок одного сообщения: наружу уходит только последняя версия."""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+# apply(key, payload) → True, если правка доставлена (или уже совпадала)
+ApplyCallback = Callable[[Hashable, object], Awaitable[bool]]
+
+
+def content_hash(*parts) -> str:
+    """Короткий хэш содержимого сообщения для сравнения версий."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+class EditCoalescer:
+    """
+    Копит правки по ключу (topic_id, message_id) в течение window секунд
+    после последней и применяет только последнюю версию.
+
+    Для уже применённых версий хранится хэш содержимого (LRU на max_tracked
+    ключей): правка, совпадающая с последней доставленной, не тратит запросов.
+    """
+
+    def __init__(self, window: float, max_tracked: int = 10000):
+        self._window = window
+        self._max_tracked = max_tracked
+        self._pending: dict[Hashable, tuple[str, object, ApplyCallback, asyncio.TimerHandle]] = {}
+        self._applied: OrderedDict[Hashable, str] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+        self._running: set[Hashable] = set()
+        self.received = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.applied = 0
+
+    def submit(self, key: Hashable, digest: str, payload, apply: ApplyCallback):
+        """Запланировать правку; более ранняя ожидающая правка ключа заменяется."""
+        self.received += 1
+        previous = self._pending.pop(key, None)
+        if previous is not None:
+            previous[3].cancel()
+            self.coalesced += 1
+        timer = asyncio.get_running_loop().call_later(self._window, self._spawn_apply, key)
+        self._pending[key] = (digest, payload, apply, timer)
+
+    def was_applied(self, key: Hashable) -> bool:
+        """Доставлялась ли уже хотя бы одна правка этого ключа."""
+        return key in self._applied
+
+    def cancel(self, key: Hashable):
+        """Отменить ожидающую правку и забыть ключ (сообщение удалено)."""
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending[3].cancel()
+        self._applied.pop(key, None)
+
+    async def drain(self):
+        """Применить все ожидающие правки (при остановке бота)."""
+        for key in list(self._pending):
+            await self._apply(key)
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    def _spawn_apply(self, key: Hashable):
+        if key in self._running:
+            # Предыдущая версия ещё отправляется — новая уйдёт после неё
+            pending = self._pending.get(key)
+            if pending is not None:
+                timer = asyncio.get_running_loop().call_later(self._window, self._spawn_apply, key)
+                self._pending[key] = (*pending[:3], timer)
+            return
+        task = asyncio.get_running_loop().create_task(self._apply(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _apply(self, key: Hashable):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        digest, payload, apply, timer = pending
+        timer.cancel()
+        if self._applied.get(key) == digest:
+            self.unchanged += 1
+            return
+        self._running.add(key)
+        try:
+            ok = await apply(key, payload)
+        except Exception:
+            logger.exception("Ошибка применения правки %s", key)
+            return
+        finally:
+            self._running.discard(key)
+        if ok:
+            self.applied += 1
+            self._applied[key] = digest
+            self._applied.move_to_end(key)
+            while len(self._applied) > self._max_tracked:
+                self._applied.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "unchanged": self.unchanged,
+            "applied": self.applied,
+        }
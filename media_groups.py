@@ -0,0 +1,107 @@
+"""Сборка альбомов (media_group_id) для пересылки одним copy_messages."""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from collections.abc import Awaitable, Callable, Hashable
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+FlushCallback = Callable[[list[Message]], Awaitable]
+
+
+class _PendingGroup:
+    __slots__ = ("messages", "flush", "timer")
+
+    def __init__(self, flush: FlushCallback):
+        self.messages: list[Message] = []
+        self.flush = flush
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MediaGroupBuffer:
+    """
+    Копит элементы альбома в течение window секунд после первого и отдаёт
+    их одной пачкой (в порядке message_id) в flush-callback.
+
+    Порядок внутри чата сохраняется: перед обычным сообщением обработчик
+    вызывает flush_chat(), который досылает незавершённые альбомы этого чата
+    и дожидается уже идущей отправки.
+    """
+
+    def __init__(self, window: float):
+        self._window = window
+        self._groups: dict[tuple[Hashable, str], _PendingGroup] = {}
+        # chat_key → (lock, [число использующих]) — lock удаляется, когда не нужен
+        self._locks: dict[Hashable, tuple[asyncio.Lock, list[int]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.albums = 0
+        self.messages = 0
+
+    def add(self, chat_key: Hashable, message: Message, flush: FlushCallback):
+        """Добавить элемент альбома; flush вызовется один раз на весь альбом."""
+        key = (chat_key, message.media_group_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _PendingGroup(flush)
+            group.timer = asyncio.get_running_loop().call_later(
+                self._window, self._spawn_flush, key
+            )
+        group.messages.append(message)
+
+    async def flush_chat(self, chat_key: Hashable):
+        """Отправить все незавершённые альбомы чата и дождаться текущей отправки."""
+        for key in [k for k in self._groups if k[0] == chat_key]:
+            await self._flush_group(key)
+        if chat_key in self._locks:
+            async with self._chat_lock(chat_key):
+                pass
+
+    def _spawn_flush(self, key: tuple[Hashable, str]):
+        task = asyncio.get_running_loop().create_task(self._flush_group(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Отправить все накопленные альбомы (при остановке бота)."""
+        for key in list(self._groups):
+            await self._flush_group(key)
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    async def _flush_group(self, key: tuple[Hashable, str]):
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        group.timer.cancel()
+        async with self._chat_lock(key[0]):
+            messages = sorted(group.messages, key=lambda m: m.message_id)
+            self.albums += 1
+            self.messages += len(messages)
+            try:
+                await group.flush(messages)
+            except Exception:
+                logger.exception("Ошибка отправки альбома %s", key)
+
+    @asynccontextmanager
+    async def _chat_lock(self, chat_key: Hashable):
+        entry = self._locks.get(chat_key)
+        if entry is None:
+            entry = self._locks[chat_key] = (asyncio.Lock(), [0])
+        lock, refs = entry
+        refs[0] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            refs[0] -= 1
+            if refs[0] == 0:
+                del self._locks[chat_key]
+
+    def stats(self) -> dict:
+        return {
+            "pending_albums": len(self._groups),
+            "albums": self.albums,
+            "messages": self.messages,
+        }
@@ -0,0 +1,266 @@
+"""Метрики в формате Prometheus: гистограммы задержек, счётчики, gauge из stats()."""
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from collections.abc import Callable
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов задержки (секунды): от 0.5 мс до 10 с
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_PREFIX = "helpbot_"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по бакетам (верхняя граница бакета)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self._buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = _PREFIX + name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._children: dict[tuple, object] = {}
+        _REGISTRY.append(self)
+
+    def labels(self, *values):
+        """Дочерняя метрика для значений меток (кэшируется — держите ссылку на горячем пути)."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                cumulative += count
+                le = _labels_text(self.labelnames, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels_text(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}_total{_labels_text(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class StatsGauges:
+    """Gauge из словаря stats() компонента: каждое числовое поле — отдельная метрика."""
+
+    def __init__(self, component: str, stats: Callable[[], dict]):
+        self.component = component
+        self._stats = stats
+        _REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        try:
+            values = self._stats()
+        except Exception:
+            logger.exception("Метрики: ошибка stats() для %s", self.component)
+            return []
+        lines = []
+        for key, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{_PREFIX}{self.component}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return lines
+
+
+_REGISTRY: list = []
+
+# ─── Метрики бота ────────────────────────────
+
+HANDLER_LATENCY = Histogram("handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+DB_LATENCY = Histogram("db_seconds", "Время вызова функции database.py", ("function",))
+CALINK_LATENCY = Histogram("calink_lookup_seconds", "Время lookup_calink_user (с кэшем)", ("function",))
+BOT_API_LATENCY = Histogram("bot_api_seconds", "Время запроса к Bot API (без ожидания лимитов)", ("method",))
+RATE_LIMIT_WAIT = Histogram("rate_limit_wait_seconds", "Ожидание токена в rate limiter", ("priority",))
+ERRORS = Counter("errors", "Исключения в измеряемых функциях", ("function",))
+BOT_API_ERRORS = Counter("bot_api_errors", "Ошибки запросов к Bot API", ("method",))
+BOT_API_RETRY_AFTER = Counter("bot_api_retry_after", "Ответы 429 (RetryAfter) от Bot API", ("method",))
+
+
+def timed(histogram: Histogram, label: str | None = None):
+    """
+    Декоратор async-функции: время вызова — в histogram, исключения — в ERRORS,
+    шаг — в trace текущего апдейта.
+    """
+    def decorator(fn):
+        name = label or fn.__name__
+        child = histogram.labels(name)
+        errors = ERRORS.labels(name)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span(name):
+                    return await fn(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def register_stats(component: str, stats: Callable[[], dict]):
+    """Экспортировать числовые поля stats() компонента как gauge."""
+    StatsGauges(component, stats)
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def log_summary():
+    """Записать в лог сводку гистограмм: вызовы, среднее, p95, p99."""
+    for metric in _REGISTRY:
+        if not isinstance(metric, Histogram):
+            continue
+        for values, child in sorted(metric._children.items()):
+            if not child.count:
+                continue
+            logger.info(
+                "%s%s: n=%d avg=%.1fms p95≤%.1fms p99≤%.1fms",
+                metric.name, list(values), child.count,
+                child.sum / child.count * 1000,
+                child.quantile(0.95) * 1000, child.quantile(0.99) * 1000,
+            )
+
+
+# ─── HTTP-эндпоинт ───────────────────────────
+
+class MetricsServer:
+    """Минимальный HTTP-сервер: GET /metrics → render(). Остальное — 404."""
+
+    def __init__(self, host: str, port: int):
+        self._host = host
+        self._port = port
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        logger.info("Метрики: http://%s:%d/metrics", self._host, self._port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
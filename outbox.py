@@ -0,0 +1,246 @@
+"""Outbox: пересылки, не прошедшие сразу, хранятся в SQLite и повторяются с backoff."""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from database import (
+    add_outbox_entry,
+    load_outbox,
+    update_outbox_attempt,
+    delete_outbox_entry,
+)
+from rate_limiter import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# deliver(entry) — выполнить пересылку; исключение TelegramError — неудача
+Deliver = Callable[[dict], Awaitable[None]]
+
+
+def is_permanent(error: Exception) -> bool:
+    """Ошибка, которую повтор не исправит (бот заблокирован, сообщение удалено...)."""
+    return isinstance(error, (Forbidden, BadRequest))
+
+
+def _chat_key(entry: dict) -> tuple[int, int]:
+    return entry["dest_chat_id"], entry["thread_id"] or 0
+
+
+class Outbox:
+    """
+    Очередь пересылок с повтором.
+
+    Записи хранятся в таблице outbox и в памяти: по очереди на чат назначения
+    (чат + топик). Из каждой очереди доставляется только головная запись —
+    порядок внутри чата сохраняется, пока она не доставлена, остальные ждут.
+    Головы разных чатов доставляют до workers воркеров параллельно.
+
+    Повтор — экспоненциальный backoff с полным jitter (base_delay · 2^n, не
+    больше max_delay), при RetryAfter — не раньше, чем просит Telegram.
+    Постоянные ошибки (Forbidden, BadRequest) и исчерпание max_attempts
+    убирают запись из очереди. Дубликаты по исходному сообщению отсекаются.
+    """
+
+    def __init__(self, workers: int, base_delay: float, max_delay: float, max_attempts: int):
+        self._workers = asyncio.Semaphore(workers)
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_attempts = max_attempts
+        self._queues: dict[tuple[int, int], deque[dict]] = {}
+        self._busy: set[tuple[int, int]] = set()
+        self._heap: list[tuple[float, int, tuple[int, int]]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._deliver: Deliver | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.enqueued = 0
+        self.delivered = 0
+        self.retries = 0
+        self.dropped = 0
+        self.duplicates = 0
+
+    async def start(self, deliver: Deliver):
+        """Загрузить неотправленное из БД и запустить доставку."""
+        self._deliver = deliver
+        for entry in await load_outbox():
+            self._append(entry)
+        if self._queues:
+            logger.info("Outbox: %d пересылок ожидают повтора", self.depth)
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def stop(self):
+        """Остановить доставку; недоставленное остаётся в БД."""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=10)
+
+    def has_pending(self, dest_chat_id: int, thread_id: int | None = None) -> bool:
+        """Есть ли недоставленное в этот чат: тогда новое тоже идёт через outbox."""
+        return (dest_chat_id, thread_id or 0) in self._queues
+
+    async def enqueue(
+        self,
+        dest_chat_id: int,
+        thread_id: int | None,
+        from_chat_id: int,
+        source_message_id: int,
+        user_id: int,
+        topic_id: int,
+        text: str | None = None,
+        album: list[tuple[int, str | None]] | None = None,
+        error: Exception | None = None,
+    ) -> bool:
+        """
+        Поставить пересылку в очередь. error — с чем упала прямая попытка,
+        text — для поискового индекса, album — [(message_id, text)] альбома.
+        False — это сообщение уже в очереди.
+        """
+        delay = self._delay(0, error) if error is not None else 0.0
+        entry = await add_outbox_entry(
+            dest_chat_id, thread_id, from_chat_id, source_message_id, user_id, topic_id,
+            time.time() + delay, repr(error) if error is not None else None, text, album,
+        )
+        if entry is None:
+            self.duplicates += 1
+            return False
+        self.enqueued += 1
+        self._append(entry)
+        return True
+
+    def _append(self, entry: dict):
+        key = _chat_key(entry)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._schedule(key, entry["next_attempt_at"])
+        queue.append(entry)
+
+    def _schedule(self, key: tuple[int, int], due_at: float):
+        heapq.heappush(self._heap, (due_at, next(self._seq), key))
+        self._wakeup.set()
+
+    def _delay(self, attempts: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempts))
+        if isinstance(error, RetryAfter):
+            delay = max(delay, retry_after_seconds(error.retry_after))
+        return delay
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, key = heapq.heappop(self._heap)
+            if key in self._busy or key not in self._queues:
+                continue
+            await self._workers.acquire()
+            self._busy.add(key)
+            task = asyncio.get_running_loop().create_task(self._attempt(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _attempt(self, key: tuple[int, int]):
+        queue = self._queues[key]
+        entry = queue[0]
+        try:
+            # finished — доставлена (или отброшена), но запись не удалилась из БД:
+            # повторяем только удаление, а не пересылку
+            if not entry.get("finished"):
+                try:
+                    await self._deliver(entry)
+                except TelegramError as e:
+                    await self._failed(key, entry, e)
+                    return
+                except Exception as e:
+                    logger.exception("Outbox: ошибка доставки #%d", entry["id"])
+                    await self._failed(key, entry, e)
+                    return
+                self.delivered += 1
+            await self._done(key, entry)
+        finally:
+            self._busy.discard(key)
+            self._workers.release()
+
+    async def _failed(self, key: tuple[int, int], entry: dict, error: Exception):
+        entry["attempts"] += 1
+        if is_permanent(error) or entry["attempts"] >= self._max_attempts:
+            self.dropped += 1
+            logger.error(
+                "Outbox: пересылка %d → %s отброшена после %d попыток: %s",
+                entry["source_message_id"], entry["dest_chat_id"], entry["attempts"], error,
+            )
+            await self._done(key, entry)
+            return
+        self.retries += 1
+        entry["next_attempt_at"] = time.time() + self._delay(entry["attempts"], error)
+        entry["last_error"] = repr(error)
+        try:
+            await update_outbox_attempt(
+                entry["id"], entry["attempts"], entry["next_attempt_at"], entry["last_error"]
+            )
+        except Exception:
+            # Повтор всё равно планируем: в памяти попытка учтена, в БД — нет
+            logger.exception("Outbox: не удалось сохранить попытку #%d", entry["id"])
+        self._schedule(key, entry["next_attempt_at"])
+
+    async def _done(self, key: tuple[int, int], entry: dict):
+        """
+        Убрать головную запись и поставить следующую запись чата сразу за ней.
+
+        Если удалить из БД не вышло, запись остаётся головой и удаление
+        повторяется с backoff — иначе очередь чата встала бы до перезапуска.
+        """
+        entry["finished"] = True
+        try:
+            await delete_outbox_entry(entry["id"])
+        except Exception as e:
+            logger.exception("Outbox: не удалось удалить #%d, повтор", entry["id"])
+            entry["attempts"] += 1
+            self._schedule(key, time.time() + self._delay(entry["attempts"], e))
+            return
+        queue = self._queues[key]
+        queue.popleft()
+        if queue:
+            self._schedule(key, min(queue[0]["next_attempt_at"], time.time()))
+        else:
+            del self._queues[key]
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        """Глубина очереди, возраст самой старой записи (сек) и счётчики."""
+        oldest = min((q[0]["created_at"] for q in self._queues.values()), default=None)
+        return {
+            "depth": self.depth,
+            "chats": len(self._queues),
+            "oldest_age": time.time() - oldest if oldest is not None else 0.0,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+        }
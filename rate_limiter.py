@@ -0,0 +1,243 @@
+"""Планировщик исходящих запросов к Bot API: лимиты Telegram, приоритеты, retry_after."""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections.abc import Callable, Coroutine
+from enum import IntEnum
+from typing import Any
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import BOT_API_ERRORS, BOT_API_LATENCY, BOT_API_RETRY_AFTER, RATE_LIMIT_WAIT
+from tracing import record, span
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Приоритет запроса: меньше — раньше. Передаётся через rate_limit_args."""
+
+    FORWARD = 0   # пересылка сообщений клиент ↔ саппорт
+    NORMAL = 1    # всё, для чего приоритет не указан
+    REACTION = 2  # реакции на сообщения саппорта
+    CARD = 3      # карточки пользователей (отправка и пин)
+    BROADCAST = 4  # рассылки: только когда нет живого трафика
+
+
+# Методы, создающие сообщения: на них действует лимит группы (N в минуту)
+_SENDING_PREFIXES = ("send", "copy", "forward")
+
+
+def retry_after_seconds(value) -> float:
+    """retry_after бывает int или timedelta (зависит от версии PTB)."""
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class _TokenBucket:
+    """Token bucket; rate ≤ 0 — без лимита, остаётся только пауза после RetryAfter."""
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = max(1.0, capacity)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до следующего токена (0 — можно сейчас)."""
+        now = time.monotonic()
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self._rate <= 0:
+            return 0.0
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def take(self):
+        if self._rate > 0:
+            self._tokens -= 1
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and self._tokens >= self._capacity
+
+
+class _PriorityGate:
+    """Выдаёт токены bucket'а ожидающим в порядке приоритета (внутри приоритета — FIFO)."""
+
+    def __init__(self, bucket: _TokenBucket):
+        self.bucket = bucket
+        self._heap: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: asyncio.Task | None = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, f in self._heap if not f.done())
+
+    async def acquire(self, priority: int):
+        if not self._heap and self.bucket.delay() == 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        try:
+            while self._heap:
+                delay = self.bucket.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                _, _, future = heapq.heappop(self._heap)
+                if future.done():  # ожидающий отменён
+                    continue
+                self.bucket.take()
+                future.set_result(None)
+        finally:
+            self._dispatcher = None
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Лимиты Telegram на исходящие запросы с chat_id:
+
+    * глобальный — global_rate запросов в секунду;
+    * личный чат — chat_rate в секунду;
+    * группа саппорта (group_chat_id) — group_per_minute сообщений в минуту
+      (только send*/copy*/forward*); 0 — без упреждающего лимита.
+
+    Ожидающие получают токены по приоритету (Priority). При RetryAfter чат
+    (и любая группа — даже без лимита) ставится на паузу на retry_after секунд,
+    запрос повторяется до max_retries раз.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        group_per_minute: float,
+        max_retries: int,
+        group_chat_id: int | None = None,
+    ):
+        self._global = _PriorityGate(_TokenBucket(global_rate, global_rate))
+        self._chat_rate = chat_rate
+        self._group_per_minute = group_per_minute
+        self._group_chat_id = group_chat_id
+        self._max_retries = max_retries
+        self._chats: dict[Any, _PriorityGate] = {}
+        self._groups: dict[Any, _PriorityGate] = {}
+        self.requests = 0
+        self.retry_after_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def initialize(self) -> None:
+        """Ничего не требуется."""
+
+    async def shutdown(self) -> None:
+        """Ничего не требуется."""
+
+    @staticmethod
+    def _is_group(chat_id) -> bool:
+        return isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+
+    def _gate(self, gates: dict, chat_id, rate: float, capacity: float) -> _PriorityGate:
+        gate = gates.get(chat_id)
+        if gate is None:
+            if len(gates) > 10_000:
+                for key in [k for k, g in gates.items() if not g.waiting and g.bucket.idle]:
+                    del gates[key]
+            gate = gates[chat_id] = _PriorityGate(_TokenBucket(rate, capacity))
+        return gate
+
+    def _chat_gate(self, chat_id, endpoint: str) -> _PriorityGate | None:
+        if not self._is_group(chat_id):
+            return self._gate(self._chats, chat_id, self._chat_rate, 1)
+        if endpoint.lower().startswith(_SENDING_PREFIXES):
+            # Лимит — только на группу саппорта; в остальных группах gate
+            # всё равно нужен: на нём держится пауза после RetryAfter
+            per_minute = self._group_per_minute if chat_id == self._group_chat_id else 0
+            return self._gate(self._groups, chat_id, per_minute / 60, per_minute)
+        return None
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict | list[dict]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: int | None,
+    ) -> bool | dict | list[dict]:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await self._call(endpoint, callback, args, kwargs)
+
+        priority = Priority.NORMAL if rate_limit_args is None else rate_limit_args
+        chat_gate = self._chat_gate(chat_id, endpoint)
+        for attempt in range(self._max_retries + 1):
+            started = time.monotonic()
+            if chat_gate is not None:
+                await chat_gate.acquire(priority)
+            await self._global.acquire(priority)
+            waited = time.monotonic() - started
+            self.requests += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            RATE_LIMIT_WAIT.labels(getattr(priority, "name", str(priority))).observe(waited)
+            record(f"rate_limit_wait:{endpoint}", waited)
+            try:
+                return await self._call(endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                retry_after = retry_after_seconds(e.retry_after)
+                if attempt >= self._max_retries:
+                    logger.warning("RetryAfter %s для %s в чате %s, попытки исчерпаны", retry_after, endpoint, chat_id)
+                    raise
+                logger.warning("RetryAfter %s для %s в чате %s, повтор", retry_after, endpoint, chat_id)
+                if chat_gate is not None:
+                    chat_gate.bucket.pause(retry_after)
+                else:
+                    await asyncio.sleep(retry_after)
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    async def _call(endpoint: str, callback, args, kwargs):
+        """Выполнить запрос к Bot API с замером задержки и учётом ошибок."""
+        started = time.perf_counter()
+        try:
+            with span(f"bot_api:{endpoint}"):
+                return await callback(*args, **kwargs)
+        except RetryAfter:
+            BOT_API_RETRY_AFTER.labels(endpoint).inc()
+            raise
+        except Exception:
+            BOT_API_ERRORS.labels(endpoint).inc()
+            raise
+        finally:
+            BOT_API_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        """Глубина очередей и время ожидания."""
+        return {
+            "global_waiting": self._global.waiting,
+            "chat_waiting": sum(g.waiting for g in self._chats.values()),
+            "group_waiting": sum(g.waiting for g in self._groups.values()),
+            "requests": self.requests,
+            "retry_after": self.retry_after_count,
+            "wait_avg": self.wait_total / self.requests if self.requests else 0.0,
+            "wait_max": self.wait_max,
+        }
@@ -0,0 +1,103 @@
+"""Периодическая перепроверка не-Calink пользователей: вдруг они зарегистрировались."""
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+
+from calink_api import lookup_calink_user
+from database import get_active_unverified_users, mark_calink_users
+
+logger = logging.getLogger(__name__)
+
+# refresh_card(user, calink_user) → message_id новой карточки или None
+RefreshCard = Callable[[dict, dict], Awaitable[int | None]]
+
+
+class CalinkReconciler:
+    """
+    Проход по не-Calink пользователям, писавшим за последние active_hours.
+
+    Пользователи читаются страницами по batch_size, в Calink уходит не больше
+    concurrency запросов одновременно (в обход кэша). Найденным обновляется
+    карточка, отметка is_calink_user пишется одной транзакцией на страницу.
+    Одновременно идёт не больше одного прохода.
+    """
+
+    def __init__(self, active_hours: float, batch_size: int, concurrency: int):
+        self._active_hours = active_hours
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._lock = asyncio.Lock()
+        self.passes = 0
+        self.checked = 0
+        self.found = 0
+        self.errors = 0
+        self.last_duration = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, refresh_card: RefreshCard) -> int:
+        """Один проход. Возвращает число найденных в Calink (0, если проход уже идёт)."""
+        if self._lock.locked():
+            return 0
+        async with self._lock:
+            started = time.monotonic()
+            since = (
+                datetime.now(timezone.utc) - timedelta(hours=self._active_hours)
+            ).strftime("%Y-%m-%d %H:%M:%S")
+            semaphore = asyncio.Semaphore(self._concurrency)
+            found = 0
+            after = 0
+            while True:
+                users = await get_active_unverified_users(since, after, self._batch_size)
+                if not users:
+                    break
+                cards = await asyncio.gather(
+                    *(self._check(semaphore, user, refresh_card) for user in users)
+                )
+                verified = [(u["user_id"], card) for u, card in zip(users, cards) if card]
+                if verified:
+                    await mark_calink_users(verified)
+                found += len(verified)
+                after = users[-1]["user_id"]
+            self.passes += 1
+            self.found += found
+            self.last_duration = time.monotonic() - started
+            logger.info(
+                "Перепроверка Calink: найдено %d, %.1f с", found, self.last_duration
+            )
+            return found
+
+    async def check_user(self, user: dict, refresh_card: RefreshCard) -> bool:
+        """Перепроверить одного пользователя сейчас. True — найден и отмечен."""
+        card = await self._check(asyncio.Semaphore(1), user, refresh_card)
+        if card:
+            await mark_calink_users([(user["user_id"], card)])
+            self.found += 1
+        return bool(card)
+
+    async def _check(self, semaphore: asyncio.Semaphore, user: dict, refresh_card: RefreshCard) -> int | None:
+        async with semaphore:
+            self.checked += 1
+            try:
+                calink_user = await lookup_calink_user(user["user_id"], refresh=True)
+                if not calink_user:
+                    return None
+                return await refresh_card(user, calink_user)
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка перепроверки user %d", user["user_id"])
+                return None
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "passes": self.passes,
+            "checked": self.checked,
+            "found": self.found,
+            "errors": self.errors,
+            "last_duration": self.last_duration,
+        }
@@ -0,0 +1,188 @@
+"""
+Бортовой самописец медленных апдейтов.
+
+Каждый апдейт (с вероятностью sample_rate) получает trace в contextvar;
+шаги внутри — замеренные функции, запросы к Bot API, ожидание лимитов и
+очередей — пишутся в него span'ами. Если апдейт обрабатывался дольше
+порога, trace целиком уходит строкой JSON в ротируемый файл вместе со
+стеком задачи, снятым в момент превышения порога. Быстрые апдейты ничего
+не пишут: вся цена — список span'ов в памяти и один таймер на апдейт.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar["_Trace | None"] = contextvars.ContextVar("trace", default=None)
+
+# Настройки задаются configure(); до вызова трассировка выключена
+_slow_sec = 0.0
+_sample_rate = 1.0
+_writer: logging.Logger | None = None
+
+# Не больше стольких span'ов на апдейт — защита от циклов с тысячами запросов
+_MAX_SPANS = 500
+
+
+class _Trace:
+    __slots__ = ("update_id", "key", "started", "spans", "depth", "stack", "tasks", "finished")
+
+    def __init__(self, update_id, key):
+        self.update_id = update_id
+        self.key = key
+        self.started = time.perf_counter()
+        self.spans: list[tuple[str, float, float, int]] = []
+        self.depth = 0
+        self.stack: list[str] | None = None
+        self.tasks = 0
+        self.finished = False
+
+    def add(self, name: str, start: float, duration: float, depth: int):
+        if not self.finished and len(self.spans) < _MAX_SPANS:
+            self.spans.append((name, start - self.started, duration, depth))
+
+
+class _Span:
+    __slots__ = ("_trace", "_name", "_start", "_depth")
+
+    def __init__(self, trace: _Trace, name: str):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._depth = self._trace.depth
+        self._trace.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._trace.depth -= 1
+        self._trace.add(self._name, self._start, time.perf_counter() - self._start, self._depth)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def configure(slow_ms: float, sample_rate: float, path: str, max_bytes: int, backups: int):
+    """Включить самописец: порог, доля трассируемых апдейтов и файл JSONL."""
+    global _slow_sec, _sample_rate, _writer
+    _slow_sec = slow_ms / 1000
+    _sample_rate = sample_rate
+    if _slow_sec <= 0:
+        return
+    writer = logging.getLogger("slow_updates")
+    writer.propagate = False
+    writer.setLevel(logging.INFO)
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    writer.addHandler(handler)
+    _writer = writer
+    logger.info("Медленные апдейты (> %d мс) пишутся в %s", slow_ms, path)
+
+
+def span(name: str):
+    """Контекст-менеджер шага. Без активного trace — пустышка."""
+    trace = _current.get()
+    if trace is None or trace.finished:
+        return _NOOP
+    return _Span(trace, name)
+
+
+def record(name: str, duration: float):
+    """Записать уже измеренный шаг (например, ожидание в очереди)."""
+    trace = _current.get()
+    if trace is not None:
+        end = time.perf_counter()
+        trace.add(name, end - duration, duration, trace.depth)
+
+
+class trace_update:
+    """
+    Async-контекст обработки одного апдейта: создаёт trace, по выходе
+    пишет его в файл, если апдейт оказался медленным.
+    """
+
+    __slots__ = ("_update", "_key", "_trace", "_token", "_timer")
+
+    def __init__(self, update: object, key):
+        self._update = update
+        self._key = key
+        self._trace = None
+
+    async def __aenter__(self):
+        if _writer is None or (_sample_rate < 1 and random.random() >= _sample_rate):
+            return self
+        update_id = getattr(self._update, "update_id", None)
+        self._trace = _Trace(update_id, self._key)
+        self._token = _current.set(self._trace)
+        # Стек снимается в момент превышения порога: видно, где апдейт застрял
+        self._timer = asyncio.get_running_loop().call_later(
+            _slow_sec, _snapshot, self._trace, asyncio.current_task()
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        trace = self._trace
+        if trace is None:
+            return False
+        self._timer.cancel()
+        _current.reset(self._token)
+        trace.finished = True
+        total = time.perf_counter() - trace.started
+        if total >= _slow_sec:
+            _write(trace, total, exc)
+        return False
+
+
+def _snapshot(trace: _Trace, task: asyncio.Task | None):
+    if trace.finished or task is None:
+        return
+    trace.tasks = len(asyncio.all_tasks())
+    # task.get_stack() у приостановленной корутины отдаёт один кадр —
+    # идём по цепочке await сами, до самого глубокого ожидания
+    stack = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(f"{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    trace.stack = stack
+
+
+def _write(trace: _Trace, total: float, exc: BaseException | None):
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "update_id": trace.update_id,
+        "key": list(trace.key) if isinstance(trace.key, tuple) else trace.key,
+        "total_ms": round(total * 1000, 1),
+        "error": repr(exc) if exc is not None else None,
+        "spans": [
+            {"name": name, "start_ms": round(start * 1000, 1), "ms": round(duration * 1000, 1), "depth": depth}
+            for name, start, duration, depth in trace.spans
+        ],
+        "stack_at_threshold": trace.stack,
+        "tasks_at_threshold": trace.tasks,
+    }
+    try:
+        _writer.info(json.dumps(entry, ensure_ascii=False))
+    except Exception:
+        logger.exception("Не удалось записать медленный апдейт")
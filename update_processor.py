@@ -0,0 +1,108 @@
+"""Параллельная обработка апдейтов с сохранением порядка внутри пользователя/топика."""
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Hashable
+from typing import Any
+
+from telegram import Chat, Update
+from telegram.ext import BaseUpdateProcessor
+
+from tracing import record, trace_update
+
+logger = logging.getLogger(__name__)
+
+# Лимит базового семафора PTB: он держит слот на всё время do_process_update,
+# включая ожидание lock'а ключа, поэтому фактически не ограничивает —
+# параллельность ограничивает свой семафор, взятый после lock'а
+_BASE_LIMIT = 1_000_000
+
+
+def ordering_key(update: object) -> Hashable | None:
+    """
+    Ключ, внутри которого апдейты обрабатываются строго по порядку.
+
+    Личка — по user_id, группа с топиками — по message_thread_id,
+    остальные чаты — по chat_id. None — порядок не важен.
+    """
+    if not isinstance(update, Update):
+        return None
+    chat = update.effective_chat
+    if chat is None:
+        return None
+    if chat.type == Chat.PRIVATE:
+        return ("user", chat.id)
+    message = update.effective_message
+    if message is not None and message.is_topic_message and message.message_thread_id:
+        return ("topic", chat.id, message.message_thread_id)
+    return ("chat", chat.id)
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает до max_concurrent_updates апдейтов одновременно, но апдейты
+    с одинаковым ordering_key — последовательно, в порядке поступления.
+
+    Порядок держится на FIFO-семантике asyncio.Lock: PTB запускает задачи
+    апдейтов в порядке получения, и они встают в очередь за lock'ом ключа
+    в том же порядке. Слот из max_concurrent_updates берётся только после
+    lock'а ключа — апдейты, ждущие своей очереди, слоты не занимают, и
+    один разговорчивый чат не останавливает остальные.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным")
+        super().__init__(_BASE_LIMIT)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._active = 0
+        self._locks: dict[Hashable, tuple[asyncio.Lock, list[int]]] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = ordering_key(update)
+        async with trace_update(update, key):
+            if key is None:
+                await self._run(coroutine)
+                return
+
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = (asyncio.Lock(), [0])
+            lock, refs = entry
+            refs[0] += 1
+            started = time.perf_counter()
+            try:
+                async with lock:
+                    record("key_queue_wait", time.perf_counter() - started)
+                    await self._run(coroutine)
+            finally:
+                refs[0] -= 1
+                if refs[0] == 0:
+                    del self._locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        started = time.perf_counter()
+        async with self._slots:
+            record("slot_wait", time.perf_counter() - started)
+            self._active += 1
+            try:
+                await coroutine
+            finally:
+                self._active -= 1
+
+    async def initialize(self) -> None:
+        """Ничего не требуется."""
+
+    async def shutdown(self) -> None:
+        """Ничего не требуется."""
+
+    def stats(self) -> dict:
+        """Активные апдейты и ожидающие своей очереди внутри ключа."""
+        queued = sum(refs[0] - (1 if lock.locked() else 0) for lock, refs in self._locks.values())
+        return {
+            "max_concurrent": self._limit,
+            "concurrent": self._active,
+            "active_keys": len(self._locks),
+            "waiting_for_key": queued,
+        }